@@ -8,37 +8,106 @@
 """
 import microbit
 import math
+from animation import Animation
+from buttons import Buttons
+from stages import COMPUTE, BLIT, SLEEP
 
 # Array of LED brightness levels (0=off, 8=on); rows and columns
 # correspond to the LEDs on the Microbit, e.g. leds[0][2] maps
 # to the second LED in the first row.
 leds = tuple(bytearray(5) for i in range(5))
 
-def display_leds():
-    
-    img_array = bytearray()
-    for row in leds:
-        img_array.extend(row)
-    img = microbit.Image(5, 5, img_array)
-    microbit.display.show(img)
+# Work lists for set_point()
+row_levels = [0.0] * 5
+column_terms = [0.0] * 5
 
 def set_point(row, column, level=9, scale=5.0):
 
+    # The squared distance splits into a row and a column term, which
+    # are computed once per row and column; only the LEDs the point
+    # reaches are then calculated, all others are set to 0
+    first_row = first_column = 5
+    last_row = last_column = 0
+    for i in range(5):
+        d = row - i
+        x = level - scale * d * d
+        row_levels[i] = x
+        if x > 0.0:
+            if i < first_row:
+                first_row = i
+            last_row = i + 1
+        d = column - i
+        x = scale * d * d
+        column_terms[i] = x
+        if x < level:
+            if i < first_column:
+                first_column = i
+            last_column = i + 1
     for led_row in range(5):
+        leds_row = leds[led_row]
         for led_column in range(5):
-            d2 = (row - led_row)**2.0 + (column - led_column)**2.0
-            leds[led_row][led_column] = int(max(level - scale * d2, 0))
+            leds_row[led_column] = 0
+    for led_row in range(first_row, last_row):
+        leds_row = leds[led_row]
+        row_level = row_levels[led_row]
+        for led_column in range(first_column, last_column):
+            x = row_level - column_terms[led_column]
+            if x > 0.0:
+                leds_row[led_column] = int(x)
+
+def render_heartbeat(i):
 
-def heartbeat(delay):
+    set_point(2, 2, scale=(i + 1)/2)
+    return leds
+
+def heartbeat(delay, profiler=None):
     
+    # A beat has 10 frames, which only need to be rendered once; the
+    # MB display then plays them in the background
+    animation = Animation(render_heartbeat, period=10)
+    animation.play(delay)
+    buttons = Buttons()
+    if profiler:
+        profiler.start(buttons)
+    while True:
+        # The beat plays in the background; check the buttons as
+        # often as they are read, so that no key repeats are lost
+        microbit.sleep(buttons.interval)
+        if profiler:
+            profiler.mark(SLEEP)
+        new_delay = delay
+        if buttons.poll():
+            new_delay = buttons.adjust(delay, 10)
+        if profiler:
+            profiler.mark(COMPUTE)
+        if new_delay != delay:
+            delay = new_delay
+            animation.play(delay)
+        if profiler:
+            profiler.mark(BLIT)
+            profiler.next()
+
+def heartbeat_effect(delay):
+
+    """ Generator version of heartbeat() for the Runner (see
+        runner.py).
+
+    """
+    animation = Animation(render_heartbeat, period=10)
+    animation.compile()
+    buttons = Buttons()
+    resumed = yield 0
     while True:
-        for i in range(10):
-            set_point(2, 2, scale=(i + 1)/2)
-            display_leds()
-            microbit.sleep(delay)    
-        if microbit.button_a.is_pressed():
-            delay = max(0, delay - 10)
-        if microbit.button_b.is_pressed():
-            delay += 10
-
-heartbeat(100)
+        if resumed:
+            # Another effect has replaced the playback
+            animation.play(delay)
+        resumed = yield buttons.interval
+        new_delay = delay
+        if buttons.poll():
+            new_delay = buttons.adjust(delay, 10)
+        if new_delay != delay:
+            delay = new_delay
+            animation.play(delay)
+
+if __name__ == '__main__':
+    heartbeat(100)
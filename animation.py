@@ -0,0 +1,148 @@
+""" Pre-render periodic effects into cached MB images.
+
+    Most effects repeat after a few frames, e.g. the waves every 8
+    offsets or the heartbeat every 10 frames. Instead of recomputing
+    the same frames forever, an Animation renders them once into a
+    list of microbit.Image objects, so that playing them back only
+    costs the display.show() calls.
+
+    The render function is called as render(frame, *params) for
+    frame = 0, 1, 2, ... in this order, so it may keep state between
+    calls (it should reset it for frame 0). It has to return the LED
+    brightness levels as an Image, a flat buffer of 25 levels or five
+    rows of five levels.
+
+    If the period is not given, it is detected by rendering frames
+    until they repeat; frames before the repeating part (e.g. while a
+    tail is building up) are kept as intro.
+
+    Animation.play() hands the images to the MB display, which then
+    shows them in the background, so that the interpreter is free for
+    other work (reading sensors, checking buttons) between frames.
+
+"""
+import microbit
+
+###
+
+def flatten(leds):
+
+    """ Return the brightness levels of leds as bytearray(25).
+
+        leds may be an Image, a flat buffer or five rows.
+
+    """
+    if isinstance(leds, microbit.Image):
+        buffer = bytearray(25)
+        for row in range(5):
+            for column in range(5):
+                buffer[row * 5 + column] = leds.get_pixel(column, row)
+        return buffer
+    buffer = bytearray()
+    for row in leds:
+        if isinstance(row, int):
+            buffer.append(row)
+        else:
+            buffer.extend(row)
+    return buffer
+
+def play_frames(intro, cycle):
+
+    """ Generator yielding the intro once and then the cycle
+        forever.
+
+    """
+    for image in intro:
+        yield image
+    while True:
+        for image in cycle:
+            yield image
+
+def find_cycle(frames, max_period):
+
+    """ Return (start, period) of the first part of frames which
+        repeats at least twice.
+
+        Raises a ValueError if no such part exists.
+
+    """
+    n = len(frames)
+    for start in range(n):
+        for period in range(1, max_period + 1):
+            if start + 3 * period > n:
+                break
+            if (frames[start:start + period] ==
+                frames[start + period:start + 2 * period] ==
+                frames[start + 2 * period:start + 3 * period]):
+                return start, period
+    raise ValueError('no period found')
+
+### Animation class
+
+class Animation:
+
+    # Parameters the frames were rendered with
+    params = None
+
+    # Images shown once before the cycle and the repeating cycle
+    intro = None
+    cycle = None
+
+    def __init__(self, render, period=None, max_period=32):
+
+        self.render = render
+        self.period = period
+        self.max_period = max_period
+
+    def compile(self, *params):
+
+        """ Return (intro, cycle) for the given render parameters.
+
+            The images are cached and only rendered again when the
+            parameters change.
+
+        """
+        if self.cycle is not None and params == self.params:
+            return self.intro, self.cycle
+        render = self.render
+        if self.period is not None:
+            start, period = 0, self.period
+            frames = [flatten(render(frame, *params))
+                      for frame in range(period)]
+        else:
+            frames = [flatten(render(frame, *params))
+                      for frame in range(4 * self.max_period)]
+            start, period = find_cycle(frames, self.max_period)
+        images = [microbit.Image(5, 5, buffer)
+                  for buffer in frames[:start + period]]
+        self.intro = images[:start]
+        self.cycle = images[start:]
+        self.params = params
+        return self.intro, self.cycle
+
+    def play(self, delay, *params):
+
+        """ Play the animation for the given render parameters in the
+            background, showing a frame every delay ms.
+
+            The MB display takes care of the playback, so the
+            method returns right away. It continues until something
+            else is shown.
+
+        """
+        intro, cycle = self.compile(*params)
+        if intro:
+            microbit.display.show(play_frames(intro, cycle),
+                                  delay=delay, wait=False)
+        else:
+            # No Python code involved in the playback at all
+            microbit.display.show(cycle, delay=delay,
+                                  wait=False, loop=True)
+
+    def invalidate(self):
+
+        """ Drop the cached images, e.g. when the render function
+            depends on state other than the parameters.
+
+        """
+        self.params = self.intro = self.cycle = None
@@ -8,11 +8,25 @@
     the drop will become negative, inversing the direction
     of the drop when moving the microbit.
 
+    The tilt is read through a TiltSensor (see sensor.py), which
+    filters out the sensor noise and reads less often while the board
+    lies still; the drop is only drawn again when it moved.
+
     MAL 2016-01-17.
 
 """
 import microbit
 import math
+import brightness
+from brightness import STEPS, OUTSIDE, LAST
+from stages import COMPUTE, QUANTIZE, BLIT, SLEEP
+from buttons import Buttons
+from sensor import TiltSensor
+try:
+    import uasyncio as asyncio
+except ImportError:
+    # Only needed for balance_async()
+    asyncio = None
 
 ### Float display class
 
@@ -21,40 +35,151 @@ class FloatDisplay:
     # Array of floating point LED brightness levels (0.0=off, 1.0=on);
     # rows and columns correspond to the LEDs on the Microbit, e.g. 
     # leds[0][2] maps to the second LED in the first row.
+    #
+    # This is the back buffer all drawing goes to.
     leds = None
 
+    # Front buffer: MB image which .display() fills in place and
+    # hands to the MB display. The display copies the image, so it
+    # can be reused for the next frame right away.
+    image = None
+
+    # Column origin: the rows are used as ring buffers, with
+    # column 0 stored at index origin. Scrolling only moves the
+    # origin instead of rebuilding the rows.
+    origin = 0
+
+    # Row indexes of the columns per origin, i.e.
+    # rotations[origin][column] == (origin + column) % 5
+    rotations = tuple(tuple((origin + column) % 5 for column in range(5))
+                      for origin in range(5))
+
+    # Work lists for add_point()
+    row_levels = None
+    column_terms = None
+
+    # Quantization table mapping int(level * STEPS) to MB LED levels;
+    # shared by all displays, use brightness.table(gamma) for a
+    # gamma curve
+    levels = brightness.LINEAR
+
+    # Copy of the rows, the origin and the table last written to
+    # .image; only the rows which changed since are written again.
+    # While the display scrolls, the rows aren't copied and stale
+    # is set.
+    shown = None
+    shown_origin = None
+    shown_levels = None
+    stale = True
+
+    # Set when .image differs from what .display() last showed
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
     def __init__(self):
 
-        self.clear()
+        self.leds = [[0.0]*5 for i in range(5)]
+        self.shown = [[0.0]*5 for i in range(5)]
+        self.image = microbit.Image(5, 5)
+        self.row_levels = [0.0] * 5
+        self.column_terms = [0.0] * 5
     
     def clear(self):
         
         """ Clear the SmartDisplay.
+
+            The rows are cleared in place, so no memory gets
+            allocated.
         
         """
-        self.leds = [[0.0]*5 for i in range(5)]
+        for row in self.leds:
+            for column in range(5):
+                row[column] = 0.0
+        self.origin = 0
 
-    def display(self):
+    def render(self):
         
         """ Write the contents of the SmartDisplay to the
-            MB image buffer and display it.
+            MB image buffer and return it.
+
+            The brightness levels are mapped to MB LED levels
+            using the quantization table .levels, which also clips
+            them to the permitted range.
 
-            The method applies clipping to keep the brightness
-            values within the permitted range.
+            The front buffer image is reused, so no memory gets
+            allocated for it. Rows which didn't change since the
+            last call are not written again.
 
         """
-        img_array = bytearray()
+        leds = self.leds
+        shown = self.shown
+        image = self.image
+        origin = self.origin
+        columns = self.rotations[origin]
+        levels = self.levels
         local_int = int
-        for row in self.leds:
-            for x in row:
-                x = local_int(x * 9.0)
-                if x < 0:
-                    x = 0
-                elif x > 9:
-                    x = 9
-                img_array.append(x)
-        img = microbit.Image(5, 5, img_array)
-        microbit.display.show(img)
+        redraw = copy = True
+        if origin != self.shown_origin or levels is not self.shown_levels:
+            # Scrolling or a new table changes all pixels; the rows
+            # are only compared again once the display stays put
+            self.shown_origin = origin
+            self.shown_levels = levels
+            self.stale = True
+            copy = False
+        elif self.stale:
+            self.stale = False
+        else:
+            redraw = False
+        changed = redraw
+        for row in range(5):
+            leds_row = leds[row]
+            if not redraw:
+                if leds_row == shown[row]:
+                    continue
+                changed = True
+            if copy:
+                shown[row][:] = leds_row
+            for column in range(5):
+                i = local_int(leds_row[columns[column]] * STEPS)
+                if i & OUTSIDE:
+                    # Clip levels outside of the table
+                    i = 0 if i < 0 else LAST
+                image.set_pixel(column, row, levels[i])
+        if changed:
+            self.changed = True
+        return image
+
+    def display(self, force=False):
+
+        """ Write the contents of the SmartDisplay to the
+            MB image buffer and display it.
+
+            The frame is only shown if it changed since the last
+            call, see .blit().
+
+        """
+        self.render()
+        self.blit(force)
+
+    def blit(self, force=False):
+
+        """ Hand the image written by the last .render() to the MB
+            display, unless it's shown already.
+
+            .blits and .skips count the frames shown and skipped.
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if self.changed or force:
+            microbit.display.show(self.image)
+            self.changed = False
+            self.blits += 1
+        else:
+            self.skips += 1
 
     def set_dot(self, row, column, level=1.0):
 
@@ -63,7 +188,7 @@ class FloatDisplay:
             Does not clear the other content.
 
         """
-        self.leds[row][column] = level
+        self.leds[row][self.rotations[self.origin][column]] = level
 
     def show_point(self, row, column, level=1.0, scale=1.0):
       
@@ -71,16 +196,54 @@ class FloatDisplay:
             interpolates the brightness.
             
             All other display content is cleared.
+
+            LEDs the point does not reach are set to 0.0.
             
         """
+        self.clear()
+        self.add_point(row, column, level, scale)
+
+    def add_point(self, row, column, level=1.0, scale=1.0):
+
+        """ Add a point at floating point row and column to the
+            display content, interpolating the brightness.
+
+            Only the LEDs the point reaches are visited, so the
+            cost depends on the size of the point, not the display.
+
+        """
+        # The squared distance splits into a row and a column term,
+        # which are computed once per row and column. The LEDs with
+        # level - scale * d2 > 0 then lie within the ranges of rows
+        # and columns where the terms alone stay below level.
+        row_levels = self.row_levels
+        column_terms = self.column_terms
+        first_row = first_column = 5
+        last_row = last_column = 0
+        for i in range(5):
+            d = row - i
+            x = level - scale * d * d
+            row_levels[i] = x
+            if x > 0.0:
+                if i < first_row:
+                    first_row = i
+                last_row = i + 1
+            d = column - i
+            x = scale * d * d
+            column_terms[i] = x
+            if x < level:
+                if i < first_column:
+                    first_column = i
+                last_column = i + 1
         leds = self.leds
-        for led_row in range(5):
-            for led_column in range(5):
-                # Calculate the squared distance
-                d2 = (row - led_row)**2.0 + (column - led_column)**2.0
-                # Set brightness based on the distance to the point,
-                # using scale for scaling
-                leds[led_row][led_column] = level - scale * d2
+        columns = self.rotations[self.origin]
+        for led_row in range(first_row, last_row):
+            leds_row = leds[led_row]
+            row_level = row_levels[led_row]
+            for led_column in range(first_column, last_column):
+                x = row_level - column_terms[led_column]
+                if x > 0.0:
+                    leds_row[columns[led_column]] += x
 
     def add(self, sd, offset_row=0, offset_column=0):
         
@@ -91,94 +254,414 @@ class FloatDisplay:
 
         """
         leds = self.leds
-        for row in range(5):
-            # Make sure we keep within the display bounds
-            if offset_row:
-                other_row_index = row + offset_row
-                if (other_row_index > 4 or 
-                    other_row_index < 0):
-                    continue
-            else:
-                other_row_index = row
+        our_columns = self.rotations[self.origin]
+        other_columns = self.rotations[sd.origin]
+        # Clip the overlapping area once, instead of per LED
+        first_row = max(0, -offset_row)
+        last_row = min(5, 5 - offset_row)
+        first_column = max(0, -offset_column)
+        last_column = min(5, 5 - offset_column)
+        for row in range(first_row, last_row):
             our_row = leds[row]
-            other_row = sd.leds[other_row_index]
-            for column in range(5):
-                # Make sure we keep within the display bounds
-                if offset_column:
-                    other_column = column + offset_column
-                    if (other_column > 4 or 
-                        other_column < 0):
-                        continue
-                else:
-                    other_column = column
-                our_row[column] = (
-                    our_row[column] + other_row[other_column])
+            other_row = sd.leds[row + offset_row]
+            for column in range(first_column, last_column):
+                our_column = our_columns[column]
+                our_row[our_column] = (
+                    our_row[our_column] +
+                    other_row[other_columns[column + offset_column]])
 
     def dim(self, factor=0.5):
         
         """ Dim the SmartDisplay content by factor.
         
         """
-        leds = self.leds
-        for row in range(5):
-            row = leds[row]
-            for column, x in enumerate(row):
-                row[column] *= x * factor
+        for row in self.leds:
+            for column in range(5):
+                row[column] *= factor
 
     def scroll_left(self, columns=1, fill_value=0.0):
     
         """ Scroll the display to the left by the given number
             of columns (default is one).
+
+            Only the origin is moved and the columns scrolled in
+            are filled, so no memory gets allocated.
         
         """
-        leds = self.leds
-        columns = min(columns, 5)
-        filler = [fill_value] * columns
-        for row in range(5):
-            leds[row] = leds[row][columns:] + filler
+        origin = self.origin
+        if columns > 5:
+            columns = 5
+        for row in self.leds:
+            # The columns scrolled out become the right-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = (origin + columns) % 5
 
     def scroll_right(self, columns=1, fill_value=0.0):
     
         """ Scroll the display to the right by the given number
             of columns (default is one).
+
+            Only the origin is moved and the columns scrolled in
+            are filled, so no memory gets allocated.
         
         """
-        leds = self.leds
-        columns = min(columns, 5)
-        filler = [fill_value] * columns
-        for row in range(5):
-            leds[row] = filler + leds[row][:-columns]
+        if columns > 5:
+            columns = 5
+        origin = (self.origin - columns) % 5
+        for row in self.leds:
+            # The columns scrolled out become the left-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = origin
+
+### Point cache class
+
+class PointCache:
+
+    """ Cache of prerendered MB images of a point.
+
+        Positions are rounded to 1/steps LED, so that nearby
+        positions share one image; rendering a point then only
+        needs a dict lookup. At most size images are kept, the
+        least recently used one is dropped to make room for a new
+        one.
+
+        hits and misses count the lookups, which helps tuning steps
+        and size against the memory used by the images.
+
+        Since the images are shared, .blit() can tell an unchanged
+        frame by the image alone and skips showing it again; blits
+        and skips count the frames shown and skipped.
+
+    """
+    # Number of lookups served from the cache and rendered
+    hits = 0
+    misses = 0
+
+    # Image last shown by .blit() and the number of frames shown
+    # and skipped
+    shown = None
+    blits = 0
+    skips = 0
+
+    def __init__(self, display, level=1.0, steps=8, size=64):
+
+        # Display used for rendering the images
+        self.display = display
+        self.level = level
+        self.steps = steps
+        # Bits per position in the keys: rows and columns are rounded
+        # to 0 - 4 * steps
+        self.shift = (4 * steps).bit_length()
+        self.size = size
+        # Maps keys to [image, last use]
+        self.entries = {}
+        self.clock = 0
+
+    def image(self, row, column, scale=1.0):
+
+        """ Return the MB image of a point at floating point row
+            and column (both in the range 0.0-4.0) drawn with scale.
+
+            The image is shared with the cache and must not be
+            changed.
+
+        """
+        steps = self.steps
+        shift = self.shift
+        row = int(row * steps + 0.5)
+        column = int(column * steps + 0.5)
+        # Use a small int as key, which doesn't need heap memory
+        key = (((int(scale * 64.0) << shift) | row) << shift) | column
+        self.clock += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[1] = self.clock
+            return entry[0]
+        self.misses += 1
+        if len(self.entries) >= self.size:
+            self.evict()
+        display = self.display
+        display.show_point(row / steps, column / steps, self.level, scale)
+        image = display.render().copy()
+        self.entries[key] = [image, self.clock]
+        return image
+
+    def show(self, row, column, scale=1.0, force=False):
+
+        """ Show the image of a point at floating point row and
+            column drawn with scale, unless it's shown already.
+
+        """
+        self.blit(self.image(row, column, scale), force)
+
+    def blit(self, image, force=False):
+
+        """ Hand image (as returned by .image()) to the MB display,
+            unless it's shown already.
+
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if image is self.shown and not force:
+            self.skips += 1
+            return
+        microbit.display.show(image)
+        self.shown = image
+        self.blits += 1
+
+    def evict(self):
+
+        """ Drop the least recently used image.
+
+        """
+        oldest = None
+        oldest_use = self.clock
+        for key, entry in self.entries.items():
+            if entry[1] < oldest_use:
+                oldest = key
+                oldest_use = entry[1]
+        del self.entries[oldest]
+
+    def clear(self):
+
+        """ Drop all images and reset the counters.
+
+        """
+        self.entries = {}
+        self.shown = None
+        self.clock = self.hits = self.misses = 0
+        self.blits = self.skips = 0
 
 ###
 
-def balance(speed):
+# Change of the speed per button press or repeat
+SPEED_STEP = 0.05
+
+# The drop moves by speed * tilt / 1024 LEDs per STEP_MS, which is
+# about the time an iteration of balance() took when it read the
+# accelerometer on every iteration
+STEP_MS = 5.0
+
+def balance(speed, profiler=None):
     x, y, z = 2.0, 2.0, 0.0
     speed = 1.0
-    fd = FloatDisplay()
+    # The point is rendered once per 1/8 LED position
+    cache = PointCache(FloatDisplay())
+    steps = cache.steps
+    buttons = Buttons()
+    # Filtered tilt, read less often while the board is still
+    sensor = TiltSensor()
+    last = sensor.now = microbit.running_time()
+    shown_row = shown_column = -1
+    if profiler:
+        profiler.start(buttons)
     while True:
-        ax, ay, az = microbit.accelerometer.get_values()
-        x += (ax / 1024.0) * speed
+        sensor.update()
+        now = sensor.now
+        factor = speed * (now - last) / (STEP_MS * 1024.0)
+        last = now
+        x += sensor.x * factor
         if x > 4.0:
             x = 4.0
         if x < 0.0:
             x = 0.0
-        y += (ay / 1024.0) * speed
+        y += sensor.y * factor
         if y > 4.0:
             y = 4.0
         if y < 0.0:
             y = 0.0
-        #z += (az / 1024.0) * speed
-        #print ('x:%4f y:%4f z:%4f ax:%4i ay:%4i az:%4i speed:%4f' % (
-        #        x, y, z, ax, ay, az, speed))
-        fd.clear()
-        fd.show_point(y, x, scale=0.75)
-        fd.display()
-        #microbit.sleep(delay)
-        if microbit.button_a.is_pressed():
-            speed -= 0.01
-            speed = max(-4.0, speed)
-        if microbit.button_b.is_pressed():
-            speed += 0.01
-            speed = min(4.0, speed)
-
-balance(0.5)
+        #print ('x:%4f y:%4f sx:%4i sy:%4i speed:%4f' % (
+        #        x, y, sensor.x, sensor.y, speed))
+        if profiler:
+            profiler.mark(COMPUTE)
+        # Only render the drop when it moved by a cache step
+        row = int(y * steps + 0.5)
+        column = int(x * steps + 0.5)
+        if row != shown_row or column != shown_column:
+            shown_row = row
+            shown_column = column
+            # Keep reading at the fast rate while the drop rolls
+            sensor.wake(now)
+            image = cache.image(y, x, scale=0.75)
+            if profiler:
+                profiler.mark(QUANTIZE)
+            cache.blit(image)
+            if profiler:
+                profiler.mark(BLIT)
+        if buttons.poll():
+            speed = buttons.adjust(speed, SPEED_STEP, -4.0, 4.0)
+        if profiler:
+            profiler.mark(COMPUTE)
+        sensor.sleep()
+        if profiler:
+            profiler.mark(SLEEP)
+            profiler.next()
+
+def balance_effect():
+
+    """ Generator version of balance() for the Runner (see
+        runner.py).
+
+    """
+    x, y = 2.0, 2.0
+    speed = 1.0
+    cache = PointCache(FloatDisplay())
+    steps = cache.steps
+    buttons = Buttons()
+    sensor = TiltSensor()
+    shown_row = shown_column = -1
+    resumed = yield 0
+    last = sensor.now = microbit.running_time()
+    while True:
+        sensor.update()
+        now = sensor.now
+        if resumed:
+            # Don't roll the drop for the time another effect was
+            # active
+            last = now
+        factor = speed * (now - last) / (STEP_MS * 1024.0)
+        last = now
+        x += sensor.x * factor
+        if x > 4.0:
+            x = 4.0
+        if x < 0.0:
+            x = 0.0
+        y += sensor.y * factor
+        if y > 4.0:
+            y = 4.0
+        if y < 0.0:
+            y = 0.0
+        row = int(y * steps + 0.5)
+        column = int(x * steps + 0.5)
+        # Another effect may have been shown in between
+        if row != shown_row or column != shown_column or resumed:
+            shown_row = row
+            shown_column = column
+            sensor.wake(now)
+            cache.show(y, x, scale=0.75, force=resumed)
+        if buttons.poll():
+            speed = buttons.adjust(speed, SPEED_STEP, -4.0, 4.0)
+        # The Runner counts the delay from the start of the frame,
+        # when the sensor was read
+        resumed = yield sensor.interval
+
+### Asynchronous version
+
+# In balance(), the sensor is read as often as the drop is rendered,
+# and checking the buttons slows down both. balance_async() runs these
+# as separate uasyncio tasks instead, each at its own rate, sharing
+# their state through a Tilt object.
+
+class Tilt:
+
+    # Position of the drop in LEDs
+    x = 2.0
+    y = 2.0
+
+    # Factor applied to the accelerometer readings; negative values
+    # inverse the direction
+    speed = 1.0
+
+    # Number of accelerometer samples and frames shown
+    samples = 0
+    frames = 0
+
+class Ticker:
+
+    """ Deadlines of a task running every period ms.
+
+    """
+    def __init__(self, period):
+
+        self.period = period
+        self.due = microbit.running_time()
+
+    def delay(self):
+
+        """ Return the time in ms until the task is due again.
+
+            If the task is late, the following deadlines move, so
+            that it doesn't run several times in a row to catch up.
+
+        """
+        self.due += self.period
+        delay = self.due - microbit.running_time()
+        if delay < 0:
+            self.due -= delay
+            return 0
+        return delay
+
+async def sample_tilt(tilt, period):
+
+    """ Move the drop by the accelerometer readings every period ms.
+
+    """
+    accelerometer = microbit.accelerometer
+    step = period / STEP_MS / 1024.0
+    ticker = Ticker(period)
+    while True:
+        factor = tilt.speed * step
+        x = tilt.x + accelerometer.get_x() * factor
+        if x > 4.0:
+            x = 4.0
+        if x < 0.0:
+            x = 0.0
+        y = tilt.y + accelerometer.get_y() * factor
+        if y > 4.0:
+            y = 4.0
+        if y < 0.0:
+            y = 0.0
+        tilt.x = x
+        tilt.y = y
+        tilt.samples += 1
+        await asyncio.sleep_ms(ticker.delay())
+
+async def render_tilt(tilt, cache, period):
+
+    """ Show the drop every period ms.
+
+    """
+    ticker = Ticker(period)
+    while True:
+        cache.show(tilt.y, tilt.x, scale=0.75)
+        tilt.frames += 1
+        await asyncio.sleep_ms(ticker.delay())
+
+async def handle_buttons(tilt, period):
+
+    """ Change the speed by the button presses and repeats, checking
+        every period ms.
+
+    """
+    buttons = Buttons(interval=0)
+    ticker = Ticker(period)
+    while True:
+        if buttons.poll():
+            tilt.speed = buttons.adjust(tilt.speed, SPEED_STEP, -4.0, 4.0)
+        await asyncio.sleep_ms(ticker.delay())
+
+async def balance_tasks(tilt, sample_period, render_period, button_period):
+
+    cache = PointCache(FloatDisplay())
+    asyncio.create_task(sample_tilt(tilt, sample_period))
+    asyncio.create_task(handle_buttons(tilt, button_period))
+    await render_tilt(tilt, cache, render_period)
+
+def balance_async(sample_period=10, render_period=40, button_period=50):
+
+    """ Run balance() as separate tasks sampling the accelerometer,
+        showing the drop and checking the buttons every sample_period,
+        render_period and button_period ms.
+
+        This needs a MicroPython port with uasyncio.
+
+    """
+    asyncio.run(balance_tasks(Tilt(), sample_period, render_period,
+                              button_period))
+
+if __name__ == '__main__':
+    balance(0.5)
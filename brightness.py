@@ -0,0 +1,113 @@
+""" Quantization tables mapping brightness levels to MB LED levels.
+
+    The float and fixed point displays keep brightness levels in the
+    range 0.0-1.0 (or scaled ints) and have to turn them into the
+    MB LED levels 0-9 for every pixel of every frame. Instead of
+    multiplying, converting and clamping per pixel, the displays look
+    up int(level * STEPS) in a table built once. The table can apply a
+    gamma curve, so brightness mapping is configurable without any
+    extra cost per pixel.
+
+    Tables are cached per gamma value, so all displays using the same
+    curve share one table.
+
+    Displays keeping MB LED levels 0-9 use the same idea for dimming,
+    fading and adding: each operation is a small table indexed by the
+    level (or the sum of two levels), built once per parameter.
+
+"""
+
+# Table entries per 1.0 brightness; a multiple of 9, so that the
+# linear table gives the same results as int(level * 9.0)
+STEPS = 36
+
+# Number of table entries; indexes outside of range(SIZE) have to be
+# clipped by the caller. Levels from SIZE / STEPS upwards are all 9.
+SIZE = 64
+
+# Mask for checking whether an index is outside of the table:
+# index & OUTSIDE is non-zero for negative indexes and indexes >= SIZE
+OUTSIDE = ~(SIZE - 1)
+
+# Last table entry, used for clipping indexes >= SIZE
+LAST = SIZE - 1
+
+# Cache of tables per gamma value, dim factor and fade amount
+_tables = {}
+_dim_tables = {}
+_fade_tables = {}
+
+###
+
+def table(gamma=1.0):
+
+    """ Return the quantization table for gamma.
+
+        The table maps index = int(level * STEPS) to the MB LED
+        level 9 * (index / STEPS) ** gamma, rounded down and limited
+        to 9. gamma 1.0 gives a linear mapping, higher values dim
+        the lower levels, which looks more even on the LEDs.
+
+    """
+    levels = _tables.get(gamma)
+    if levels is None:
+        # The small offset keeps float rounding from turning e.g.
+        # 9 * (4 / 36) into 0.999...
+        levels = bytes(min(9, int(9 * (i / STEPS) ** gamma + 0.0001))
+                       for i in range(SIZE))
+        _tables[gamma] = levels
+    return levels
+
+def level_table(gamma=1.0):
+
+    """ Return the quantization table for gamma applied to integer
+        levels 0-9.
+
+        This is meant for displays which keep MB LED levels, e.g.
+        level_table(gamma)[level] is the gamma corrected level.
+
+    """
+    levels = table(gamma)
+    return bytes(levels[level * STEPS // 9] for level in range(10))
+
+def dim_table(factor):
+
+    """ Return the table mapping the MB LED levels 0-9 to the levels
+        dimmed by factor, i.e. round(level * factor) limited to 0-9.
+
+        Tables are cached per factor.
+
+    """
+    levels = _dim_tables.get(factor)
+    if levels is None:
+        # Not a generator expression: using factor in one would
+        # allocate a cell for it on every call, cached or not
+        levels = bytearray(10)
+        for level in range(10):
+            levels[level] = max(0, min(9, round(level * factor)))
+        levels = _dim_tables[factor] = bytes(levels)
+    return levels
+
+def fade_table(amount=1):
+
+    """ Return the table mapping the MB LED levels 0-9 to the levels
+        reduced by amount, but not below 0.
+
+        Tables are cached per amount.
+
+    """
+    levels = _fade_tables.get(amount)
+    if levels is None:
+        # See dim_table()
+        levels = bytearray(10)
+        for level in range(10):
+            levels[level] = max(0, level - amount)
+        levels = _fade_tables[amount] = bytes(levels)
+    return levels
+
+# Table used by default
+LINEAR = table()
+
+# Table mapping the sum of two MB LED levels (0-18) to the sum
+# limited to 9, for adding levels without overflow
+SATURATE = bytes(min(9, level) for level in range(19))
@@ -0,0 +1,155 @@
+""" Edge-triggered button input with long presses and key repeat.
+
+    The effects used to check button_a.is_pressed() once per frame
+    (or per cycle), which misses presses between the checks and
+    changes a setting once per check while a button is held, so how
+    fast it changes depends on the frame rate. Buttons.poll() reads
+    the presses the MB counts with get_presses() instead, so that no
+    press is lost, and reads both buttons at most every interval ms,
+    however often it's called.
+
+    Each press counts as one step. Holding a button down for
+    repeat_delay ms makes it a long press, which then repeats a step
+    every repeat_interval ms, getting faster with each repeat until
+    min_interval is reached. The repeats are timed with
+    microbit.running_time(), so the steps counted while a button is
+    held don't depend on how often the buttons are polled. The MB
+    doesn't tell when a button was released, though, so the repeats
+    falling due between the last poll and the release are lost:
+    effects should poll on every frame and leave it to .poll() to
+    limit the reads to one per interval.
+
+    The presses need no debouncing here: the MB firmware filters the
+    button input and only counts a press once the button is stable.
+
+    Buttons.adjust() applies the steps of both buttons to a setting,
+    e.g. a delay: button A decreases it, button B increases it.
+
+    Note that get_presses() and was_pressed() share the press count,
+    so a button polled here can't also be checked with was_pressed()
+    elsewhere; a Profiler reads its button from the Buttons instead
+    (see Profiler.start()).
+
+"""
+import microbit
+
+### Button class
+
+class Button:
+
+    # Number of steps since the last poll: presses and repeats
+    steps = 0
+
+    # Set while the button is held down
+    held = False
+
+    # Set on the poll when holding the button becomes a long press;
+    # long_held stays set until the button is released
+    long_press = False
+    long_held = False
+
+    # Time the next repeat is due and the current repeat interval,
+    # in ms
+    repeat_at = 0
+    interval = 0
+
+    def __init__(self, button, repeat_delay=500, repeat_interval=200,
+                 min_interval=30):
+
+        self.button = button
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+        self.min_interval = min_interval
+        # Drop the presses counted before
+        button.get_presses()
+
+    def poll(self, now):
+
+        """ Read the button state at time now (in ms) and update
+            .steps and the flags.
+
+        """
+        button = self.button
+        presses = button.get_presses()
+        held = button.is_pressed()
+        self.long_press = False
+        if not (presses or held or self.held):
+            # Not touched, which is the common case
+            self.steps = 0
+            return
+        steps = presses
+        if held and (presses or not self.held):
+            # A new press starts the repeat timer
+            self.repeat_at = now + self.repeat_delay
+            self.interval = self.repeat_interval
+            self.long_held = False
+        if held:
+            repeat_at = self.repeat_at
+            if now >= repeat_at and not self.long_held:
+                self.long_press = self.long_held = True
+            while now >= repeat_at:
+                steps += 1
+                interval = self.interval
+                repeat_at += interval
+                # Speed up the repeats
+                interval = interval * 3 // 4
+                if interval < self.min_interval:
+                    interval = self.min_interval
+                self.interval = interval
+            self.repeat_at = repeat_at
+        else:
+            self.long_held = False
+        self.held = held
+        self.steps = steps
+
+### Buttons class
+
+class Buttons:
+
+    # Time the buttons may be read again in ms
+    due = 0
+
+    def __init__(self, interval=50, repeat_delay=500, repeat_interval=200,
+                 min_interval=30):
+
+        # Minimum time between two polls in ms
+        self.interval = interval
+        self.a = Button(microbit.button_a, repeat_delay, repeat_interval,
+                        min_interval)
+        self.b = Button(microbit.button_b, repeat_delay, repeat_interval,
+                        min_interval)
+        self.due = microbit.running_time()
+
+    def poll(self):
+
+        """ Read both buttons, unless they were read less than
+            .interval ms ago.
+
+            Returns True if the buttons were read; the steps of the
+            buttons are only valid then.
+
+        """
+        now = microbit.running_time()
+        if now < self.due:
+            return False
+        self.due = now + self.interval
+        self.a.poll(now)
+        self.b.poll(now)
+        return True
+
+    def adjust(self, value, step, low=0, high=None):
+
+        """ Return value decreased by step per step of button A and
+            increased by step per step of button B, kept within low
+            and high (None for no limit).
+
+        """
+        steps = self.b.steps - self.a.steps
+        if not steps:
+            return value
+        value += steps * step
+        if value < low:
+            value = low
+        if high is not None and value > high:
+            value = high
+        return value
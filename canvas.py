@@ -0,0 +1,141 @@
+""" Canvas of arbitrary size with a 5x5 viewport onto it.
+
+    Long scenes (banners, terrain, wave trains) can be drawn onto the
+    canvas once. Showing the next part of the scene then only needs
+    moving the viewport, which costs the same regardless of the canvas
+    width.
+
+    The canvas wraps around horizontally, so scrolling past the
+    right edge continues with the left-most columns.
+
+"""
+import microbit
+
+### Canvas class
+
+class Canvas:
+
+    # Size of the canvas in LEDs
+    width = 0
+    height = 0
+
+    # Frame buffer with the brightness levels (0=off, 9=on);
+    # buffer[row * width + column] maps to the dot in row and column
+    buffer = None
+
+    # Upper left corner of the viewport on the canvas
+    view_row = 0
+    view_column = 0
+
+    # Image used for displaying the viewport; filled in place
+    image = None
+
+    # Set by the drawing and viewport methods when the viewport
+    # has to be shown again; code writing to .buffer directly has
+    # to set it as well
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
+    def __init__(self, width, height=5):
+
+        if width < 5 or height < 5:
+            raise ValueError('canvas must be at least 5x5')
+        self.width = width
+        self.height = height
+        self.buffer = bytearray(width * height)
+        self.image = microbit.Image(5, 5)
+
+    def clear(self):
+
+        """ Clear the Canvas.
+
+        """
+        buffer = self.buffer
+        for i in range(len(buffer)):
+            buffer[i] = 0
+        self.changed = True
+
+    def set_dot(self, row, column, level=9):
+
+        """ Set a single dot on the canvas to level.
+
+        """
+        self.buffer[row * self.width + column] = level
+        self.changed = True
+
+    def get_dot(self, row, column):
+
+        """ Return the level of the dot at row and column.
+
+        """
+        return self.buffer[row * self.width + column]
+
+    def set_column(self, column, levels):
+
+        """ Set the dots of column to levels, starting at the top.
+
+        """
+        buffer = self.buffer
+        width = self.width
+        i = column
+        for level in levels:
+            buffer[i] = level
+            i += width
+        self.changed = True
+
+    def pan(self, row, column):
+
+        """ Move the upper left corner of the viewport to row and
+            column.
+
+            row is clipped to keep the viewport on the canvas,
+            column wraps around.
+
+        """
+        self.view_row = max(0, min(row, self.height - 5))
+        self.view_column = column % self.width
+        self.changed = True
+
+    def scroll(self, columns=1):
+
+        """ Move the viewport right by the given number of columns
+            (default is one, negative values move it left).
+
+        """
+        self.view_column = (self.view_column + columns) % self.width
+        self.changed = True
+
+    def display(self, force=False):
+
+        """ Show the viewport on the MB display.
+
+            The viewport is only written and shown if the canvas
+            changed or the viewport moved since the last call;
+            .blits and .skips count the frames shown and skipped.
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if not (self.changed or force):
+            self.skips += 1
+            return
+        buffer = self.buffer
+        width = self.width
+        image = self.image
+        start = self.view_row * width
+        first_column = self.view_column
+        for row in range(5):
+            column = first_column
+            for x in range(5):
+                if column == width:
+                    # Wrap around
+                    column = 0
+                image.set_pixel(x, row, buffer[start + column])
+                column += 1
+            start += width
+        microbit.display.show(image)
+        self.changed = False
+        self.blits += 1
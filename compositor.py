@@ -0,0 +1,218 @@
+""" Compose a frame from several layers in one go.
+
+    Instead of adding display after display to a frame with add(),
+    which checks the bounds for every LED and needs a full display
+    per sprite, a Compositor takes a list of layers. Each layer has
+    its own size, a position on the display and a blend mode. Its
+    overlap with the display is clipped once and then blended straight
+    into the frame buffer, so no intermediate buffers are needed.
+
+    Blending uses tables indexed by level * 10 + layer level (MB LED
+    levels 0-9), built once per mode.
+
+"""
+import microbit
+
+# Blend modes
+ADD = 'add'             # sum, limited to 9
+MAX = 'max'             # brighter of both levels
+MULTIPLY = 'multiply'   # product, scaled to 0-9
+ALPHA = 'alpha'         # mix of both levels, weighted by alpha
+
+# Cache of blend tables per mode and alpha
+_blend_tables = {}
+
+###
+
+def blend_table(mode, alpha=0.5):
+
+    """ Return the table mapping level * 10 + layer level to the
+        blended level for mode.
+
+        alpha is the weight of the layer level in ALPHA mode and
+        ignored otherwise.
+
+    """
+    if mode != ALPHA:
+        alpha = None
+    key = (mode, alpha)
+    table = _blend_tables.get(key)
+    if table is not None:
+        return table
+    if mode == ADD:
+        blend = lambda x, y: min(x + y, 9)
+    elif mode == MAX:
+        blend = max
+    elif mode == MULTIPLY:
+        blend = lambda x, y: round(x * y / 9)
+    elif mode == ALPHA:
+        blend = lambda x, y: round(x * (1.0 - alpha) + y * alpha)
+    else:
+        raise ValueError('unknown blend mode: %r' % mode)
+    table = bytes(blend(x, y) for x in range(10) for y in range(10))
+    _blend_tables[key] = table
+    return table
+
+### Layer class
+
+class Layer:
+
+    # Size of the layer in LEDs
+    width = 5
+    height = 5
+
+    # Position of the upper left corner of the layer on the display;
+    # may be negative or beyond the display
+    row = 0
+    column = 0
+
+    # Brightness levels (0=off, 9=on);
+    # buffer[row * width + column] maps to the dot in row and column
+    buffer = None
+
+    # Blend table, see blend_table()
+    table = None
+
+    def __init__(self, width=5, height=5, row=0, column=0,
+                 mode=ADD, alpha=0.5, buffer=None):
+
+        self.width = width
+        self.height = height
+        self.row = row
+        self.column = column
+        if buffer is None:
+            buffer = bytearray(width * height)
+        elif len(buffer) != width * height:
+            raise ValueError('buffer does not match the layer size')
+        self.buffer = buffer
+        self.blend(mode, alpha)
+
+    def blend(self, mode, alpha=0.5):
+
+        """ Set the blend mode of the layer.
+
+        """
+        self.table = blend_table(mode, alpha)
+
+    def move(self, row, column):
+
+        """ Move the upper left corner of the layer to row and
+            column of the display.
+
+        """
+        self.row = row
+        self.column = column
+
+    def set_dot(self, row, column, level=9):
+
+        """ Set a single dot on the layer to level.
+
+        """
+        self.buffer[row * self.width + column] = level
+
+### Compositor class
+
+class Compositor:
+
+    # Frame buffer with the composed brightness levels, in the order
+    # microbit.Image(5, 5, buffer) expects
+    buffer = None
+
+    # MB image the frames are written to; .render() fills it in
+    # place, so that no image is created per frame
+    image = None
+
+    # Copy of the frame buffer last written to .image; starts out
+    # with invalid levels, so that the first frame is written
+    shown = None
+
+    # Set when .image differs from what .display() last showed
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
+    def __init__(self):
+
+        self.buffer = bytearray(25)
+        self.image = microbit.Image(5, 5)
+        self.shown = bytearray(b'\xff' * 25)
+
+    def compose(self, layers, background=0):
+
+        """ Blend the layers in the given order onto a display filled
+            with the background level and return the frame buffer.
+
+        """
+        buffer = self.buffer
+        for i in range(25):
+            buffer[i] = background
+        for layer in layers:
+            top = layer.row
+            left = layer.column
+            width = layer.width
+            # Clip the overlap with the display once, instead of
+            # checking the bounds per LED
+            first_row = top if top > 0 else 0
+            last_row = top + layer.height
+            if last_row > 5:
+                last_row = 5
+            first_column = left if left > 0 else 0
+            last_column = left + width
+            if last_column > 5:
+                last_column = 5
+            if first_row >= last_row or first_column >= last_column:
+                continue
+            source = layer.buffer
+            table = layer.table
+            for row in range(first_row, last_row):
+                start = row * 5
+                # Offset of the layer dot from the frame buffer index
+                shift = (row - top) * width - left - start
+                for i in range(start + first_column, start + last_column):
+                    buffer[i] = table[buffer[i] * 10 + source[i + shift]]
+        return buffer
+
+    def render(self, layers, background=0):
+
+        """ Compose the layers, write the frame to .image and return
+            the image.
+
+            Only the dots which changed since the last frame are
+            written.
+
+        """
+        buffer = self.compose(layers, background)
+        shown = self.shown
+        image = self.image
+        if buffer == shown:
+            return image
+        i = 0
+        for row in range(5):
+            for column in range(5):
+                level = buffer[i]
+                if level != shown[i]:
+                    image.set_pixel(column, row, level)
+                    shown[i] = level
+                i += 1
+        self.changed = True
+        return image
+
+    def display(self, layers, background=0, force=False):
+
+        """ Compose the layers and display the frame.
+
+            The frame is only shown if it differs from the one shown
+            last; .blits and .skips count the frames shown and
+            skipped. Pass force=True if something else was shown on
+            the MB display in the meantime.
+
+        """
+        image = self.render(layers, background)
+        if not (self.changed or force):
+            self.skips += 1
+            return
+        microbit.display.show(image)
+        self.changed = False
+        self.blits += 1
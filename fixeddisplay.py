@@ -0,0 +1,316 @@
+""" FloatDisplay variant using fixed point integers.
+
+    On MicroPython, each float operation allocates a new float object
+    on the heap, so FloatDisplay creates lots of garbage per frame.
+    FixedDisplay has the same API, but stores the brightness levels
+    as integers scaled by ONE (i.e. 1.0 is stored as ONE) in arrays,
+    so rendering and displaying only uses small ints, which don't
+    need any heap memory.
+
+    Float arguments (levels, positions, factors) are converted once
+    per call.
+
+"""
+import microbit
+import array
+import brightness
+from brightness import STEPS, OUTSIDE, LAST
+
+# Number of fractional bits and the integer representing 1.0
+SHIFT = 12
+ONE = 1 << SHIFT
+
+# Number of fractional bits used for the scale of show_point()
+SCALE_SHIFT = 6
+
+### Fixed display class
+
+class FixedDisplay:
+
+    # Array of fixed point LED brightness levels (0=off, ONE=on);
+    # rows and columns correspond to the LEDs on the Microbit, e.g.
+    # leds[0][2] maps to the third LED in the first row.
+    #
+    # This is the back buffer all drawing goes to.
+    leds = None
+
+    # Front buffer: MB image which .display() fills in place and
+    # hands to the MB display.
+    image = None
+
+    # Column origin: the rows are used as ring buffers, with
+    # column 0 stored at index origin. Scrolling only moves the
+    # origin instead of rebuilding the rows.
+    origin = 0
+
+    # Row indexes of the columns per origin, i.e.
+    # rotations[origin][column] == (origin + column) % 5
+    rotations = tuple(tuple((origin + column) % 5 for column in range(5))
+                      for origin in range(5))
+
+    # Quantization table mapping (level * STEPS) >> SHIFT to MB LED
+    # levels; use brightness.table(gamma) for a gamma curve
+    levels = brightness.LINEAR
+
+    # Work arrays for add_point()
+    row_terms = None
+    column_terms = None
+
+    # Copy of the rows, the origin and the table last written to
+    # .image; only the rows which changed since are written again.
+    # While the display scrolls, the rows aren't copied and stale
+    # is set.
+    shown = None
+    shown_origin = None
+    shown_levels = None
+    stale = True
+
+    # Set when .image differs from what .display() last showed
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
+    def __init__(self):
+
+        self.leds = [array.array('i', [0] * 5) for i in range(5)]
+        self.shown = [array.array('i', [0] * 5) for i in range(5)]
+        self.image = microbit.Image(5, 5)
+        self.row_terms = array.array('i', [0] * 5)
+        self.column_terms = array.array('i', [0] * 5)
+
+    def clear(self):
+
+        """ Clear the FixedDisplay.
+
+        """
+        for row in self.leds:
+            for column in range(5):
+                row[column] = 0
+        self.origin = 0
+
+    def render(self):
+
+        """ Write the contents of the FixedDisplay to the
+            MB image buffer and return it.
+
+            The brightness levels are mapped to MB LED levels
+            using the quantization table .levels, which also clips
+            them to the permitted range.
+
+            Rows which are the same as on the last call are left
+            as they are. Comparing and copying a row happens in one
+            go, which is much cheaper than writing its pixels.
+
+        """
+        leds = self.leds
+        shown = self.shown
+        image = self.image
+        origin = self.origin
+        columns = self.rotations[origin]
+        levels = self.levels
+        redraw = copy = True
+        if origin != self.shown_origin or levels is not self.shown_levels:
+            # Scrolling or a new table changes all pixels; the rows
+            # are only compared again once the display stays put
+            self.shown_origin = origin
+            self.shown_levels = levels
+            self.stale = True
+            copy = False
+        elif self.stale:
+            self.stale = False
+        else:
+            redraw = False
+        changed = redraw
+        for row in range(5):
+            leds_row = leds[row]
+            if not redraw:
+                if leds_row == shown[row]:
+                    continue
+                changed = True
+            if copy:
+                shown[row][:] = leds_row
+            for column in range(5):
+                i = (leds_row[columns[column]] * STEPS) >> SHIFT
+                if i & OUTSIDE:
+                    # Clip levels outside of the table
+                    i = 0 if i < 0 else LAST
+                image.set_pixel(column, row, levels[i])
+        if changed:
+            self.changed = True
+        return image
+
+    def display(self, force=False):
+
+        """ Write the contents of the FixedDisplay to the
+            MB image buffer and display it.
+
+            The frame is only shown if it changed since the last
+            call, see .blit().
+
+        """
+        self.render()
+        self.blit(force)
+
+    def blit(self, force=False):
+
+        """ Hand the image written by the last .render() to the MB
+            display, unless it's shown already.
+
+            .blits and .skips count the frames shown and skipped.
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if self.changed or force:
+            microbit.display.show(self.image)
+            self.changed = False
+            self.blits += 1
+        else:
+            self.skips += 1
+
+    def set_dot(self, row, column, level=1.0):
+
+        """ Set a single dot on the display to level.
+
+            Does not clear the other content.
+
+        """
+        self.leds[row][self.rotations[self.origin][column]] = int(level * ONE)
+
+    def show_point(self, row, column, level=1.0, scale=5.0):
+
+        """ This works with floating point row and column and
+            interpolates the brightness.
+
+            All other display content is cleared.
+
+            LEDs the point does not reach are set to 0.
+
+        """
+        self.clear()
+        self.add_point(row, column, level, scale)
+
+    def add_point(self, row, column, level=1.0, scale=5.0):
+
+        """ Add a point at floating point row and column to the
+            display content, interpolating the brightness.
+
+            Only the LEDs the point reaches are visited, so the
+            cost depends on the size of the point, not the display.
+
+        """
+        # The scale uses fewer fractional bits, so that the products
+        # in add_fixed_point() stay small ints (below 2**30) for
+        # scales up to 80
+        self.add_fixed_point(int(row * ONE), int(column * ONE),
+                             int(level * ONE),
+                             int(scale * (1 << SCALE_SHIFT)))
+
+    def add_fixed_point(self, row, column, level, scale):
+
+        """ add_point() for fixed point arguments: row, column and
+            level are scaled by ONE, scale by 1 << SCALE_SHIFT.
+
+        """
+        # The scaled squared distance splits into a row and a column
+        # term, which are computed once per row and column. The LEDs
+        # with level - scale * d2 > 0 then lie within the ranges of
+        # rows and columns where the terms alone stay below limit.
+        limit = level << SCALE_SHIFT
+        row_terms = self.row_terms
+        column_terms = self.column_terms
+        first_row = first_column = 5
+        last_row = last_column = 0
+        for i in range(5):
+            d = row - (i << SHIFT)
+            x = scale * ((d * d) >> SHIFT)
+            row_terms[i] = x
+            if x < limit:
+                if i < first_row:
+                    first_row = i
+                last_row = i + 1
+            d = column - (i << SHIFT)
+            x = scale * ((d * d) >> SHIFT)
+            column_terms[i] = x
+            if x < limit:
+                if i < first_column:
+                    first_column = i
+                last_column = i + 1
+        leds = self.leds
+        columns = self.rotations[self.origin]
+        for led_row in range(first_row, last_row):
+            leds_row = leds[led_row]
+            row_term = row_terms[led_row]
+            for led_column in range(first_column, last_column):
+                x = level - ((row_term + column_terms[led_column])
+                             >> SCALE_SHIFT)
+                if x > 0:
+                    leds_row[columns[led_column]] += x
+
+    def add(self, sd, offset_row=0, offset_column=0):
+
+        """ Add the content of the other FixedDisplay to this one.
+
+            No overflow checks are done on the values to avoid
+            clipping in case additional operations are applied.
+
+        """
+        leds = self.leds
+        our_columns = self.rotations[self.origin]
+        other_columns = self.rotations[sd.origin]
+        # Clip the overlapping area once, instead of per LED
+        first_row = max(0, -offset_row)
+        last_row = min(5, 5 - offset_row)
+        first_column = max(0, -offset_column)
+        last_column = min(5, 5 - offset_column)
+        for row in range(first_row, last_row):
+            our_row = leds[row]
+            other_row = sd.leds[row + offset_row]
+            for column in range(first_column, last_column):
+                our_column = our_columns[column]
+                our_row[our_column] += other_row[
+                    other_columns[column + offset_column]]
+
+    def dim(self, factor=0.5):
+
+        """ Dim the FixedDisplay content by factor.
+
+        """
+        factor = int(factor * ONE)
+        for row in self.leds:
+            for column in range(5):
+                row[column] = (row[column] * factor) >> SHIFT
+
+    def scroll_left(self, columns=1, fill_value=0.0):
+
+        """ Scroll the display to the left by the given number
+            of columns (default is one).
+
+        """
+        origin = self.origin
+        if columns > 5:
+            columns = 5
+        fill_value = int(fill_value * ONE)
+        for row in self.leds:
+            # The columns scrolled out become the right-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = (origin + columns) % 5
+
+    def scroll_right(self, columns=1, fill_value=0.0):
+
+        """ Scroll the display to the right by the given number
+            of columns (default is one).
+
+        """
+        if columns > 5:
+            columns = 5
+        origin = (self.origin - columns) % 5
+        fill_value = int(fill_value * ONE)
+        for row in self.leds:
+            # The columns scrolled out become the left-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = origin
@@ -0,0 +1,221 @@
+""" SmartDisplay variant using a flat 25 byte frame buffer.
+
+    The LED brightness levels are kept in a single bytearray(25),
+    in the same row-major order microbit.Image(5, 5, buffer) expects,
+    so the MB image can be created from the buffer without first
+    concatenating the rows. The image copies the buffer, so each
+    frame shown still allocates a new image; SmartDisplay and Canvas
+    fill one image in place instead, at the cost of a set_pixel()
+    call per LED.
+
+    The rows are available as memoryviews via .leds, so code indexing
+    leds[row][column] continues to work.
+
+"""
+import microbit
+import brightness
+
+### Flat display class
+
+class FlatDisplay:
+
+    # Frame buffer with the LED brightness levels (0=off, 9=on);
+    # buffer[row * 5 + column] maps to the LED in row and column.
+    buffer = None
+
+    # Tuple of memoryviews on the rows of the buffer, e.g. leds[0][2]
+    # maps to the third LED in the first row.
+    leds = None
+
+    # Work lists for add_point()
+    row_levels = None
+    column_terms = None
+
+    # Copy of the frame buffer last shown by .display(); starts
+    # out with invalid levels, so that the first frame is shown
+    shown = None
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
+    def __init__(self):
+
+        self.buffer = bytearray(25)
+        self.shown = bytearray(b'\xff' * 25)
+        view = memoryview(self.buffer)
+        self.leds = tuple(view[row * 5:row * 5 + 5] for row in range(5))
+        self.row_levels = [0.0] * 5
+        self.column_terms = [0.0] * 5
+
+    def clear(self):
+
+        """ Clear the FlatDisplay.
+
+        """
+        buffer = self.buffer
+        for i in range(25):
+            buffer[i] = 0
+
+    def render(self):
+
+        """ Return the contents of the FlatDisplay as a new MB
+            image.
+
+            The MB image copies the frame buffer in one go, but is
+            allocated on every call.
+
+        """
+        return microbit.Image(5, 5, self.buffer)
+
+    def display(self, force=False):
+
+        """ Write the contents of the FlatDisplay to the
+            MB image buffer and display it.
+
+            The frame is only shown if the frame buffer changed
+            since the last call, which takes a single buffer
+            compare; .blits and .skips count the frames shown and
+            skipped. Pass force=True if something else was shown
+            on the MB display in the meantime.
+
+        """
+        buffer = self.buffer
+        shown = self.shown
+        if buffer == shown and not force:
+            self.skips += 1
+            return
+        shown[:] = buffer
+        microbit.display.show(self.render())
+        self.blits += 1
+
+    def set_dot(self, row, column, level=9):
+
+        """ Set a single dot on the display to level.
+
+            Does not clear the other content.
+
+        """
+        self.buffer[row * 5 + column] = level
+
+    def show_point(self, row, column, level=9, scale=5.0):
+
+        """ This works with floating point row and column and
+            interpolates the brightness.
+
+            All other display content is cleared.
+
+        """
+        self.clear()
+        self.add_point(row, column, level, scale)
+
+    def add_point(self, row, column, level=9, scale=5.0):
+
+        """ Add a point at floating point row and column to the
+            display content, interpolating the brightness.
+
+            Only the LEDs the point reaches are visited, so the
+            cost depends on the size of the point, not the display.
+
+        """
+        # The squared distance splits into a row and a column term,
+        # which are computed once per row and column. The LEDs with
+        # level - scale * d2 > 0 then lie within the ranges of rows
+        # and columns where the terms alone stay below level.
+        row_levels = self.row_levels
+        column_terms = self.column_terms
+        first_row = first_column = 5
+        last_row = last_column = 0
+        for i in range(5):
+            d = row - i
+            x = level - scale * d * d
+            row_levels[i] = x
+            if x > 0.0:
+                if i < first_row:
+                    first_row = i
+                last_row = i + 1
+            d = column - i
+            x = scale * d * d
+            column_terms[i] = x
+            if x < level:
+                if i < first_column:
+                    first_column = i
+                last_column = i + 1
+        buffer = self.buffer
+        for led_row in range(first_row, last_row):
+            row_level = row_levels[led_row]
+            start = led_row * 5
+            for led_column in range(first_column, last_column):
+                x = row_level - column_terms[led_column]
+                if x > 0.0:
+                    # Make sure we don't overflow
+                    i = start + led_column
+                    buffer[i] = min(buffer[i] + int(x), 9)
+
+    def add(self, sd, offset_row=0, offset_column=0):
+
+        """ Add the content of the other FlatDisplay to this one.
+
+            The other display's rows are read at row + offset_row and
+            column + offset_column; LEDs without a counterpart are
+            left unchanged.
+
+        """
+        buffer = self.buffer
+        other = sd.buffer
+        # Clip the overlapping area once, instead of per LED
+        first_row = max(0, -offset_row)
+        last_row = min(5, 5 - offset_row)
+        first_column = max(0, -offset_column)
+        last_column = min(5, 5 - offset_column)
+        offset = offset_row * 5 + offset_column
+        saturate = brightness.SATURATE
+        for row in range(first_row, last_row):
+            for i in range(row * 5 + first_column, row * 5 + last_column):
+                # Make sure we don't overflow
+                buffer[i] = saturate[buffer[i] + other[i + offset]]
+
+    def dim(self, factor=0.5):
+
+        """ Dim the FlatDisplay content by factor.
+
+            The dimmed levels come from a table cached per factor,
+            so no float math is needed per LED.
+
+        """
+        self.map_levels(brightness.dim_table(factor))
+
+    def fade(self, amount=1):
+
+        """ Reduce the levels of the FlatDisplay content by amount,
+            but not below 0.
+
+        """
+        self.map_levels(brightness.fade_table(amount))
+
+    def map_levels(self, table):
+
+        """ Replace each level of the FlatDisplay content by
+            table[level].
+
+        """
+        buffer = self.buffer
+        for i in range(25):
+            buffer[i] = table[buffer[i]]
+
+    def scroll_left(self, columns=1):
+
+        """ Scroll the display to the left by the given number
+            of columns (default is one).
+
+            The buffer is updated in place.
+
+        """
+        buffer = self.buffer
+        if columns > 5:
+            columns = 5
+        for start in range(0, 25, 5):
+            for i in range(start, start + 5 - columns):
+                buffer[i] = buffer[i + columns]
+            for i in range(start + 5 - columns, start + 5):
+                buffer[i] = 0
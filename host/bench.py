@@ -0,0 +1,1211 @@
+""" Benchmark the display strategies and effects on the host.
+
+    Each case loads one of the scripts under the emulator (see
+    microbit.py), optionally adjusts its namespace and then runs an
+    effect loop for a number of frames. Two passes are made per case:
+
+    * wall: plain run, giving host frames/sec (informational only,
+      since it depends on the machine)
+    * device: run with opcode tracing under tracemalloc, giving
+      the frames/sec the cost model predicts for the device (vfps),
+      the share of the time the interpreter is busy (rather than
+      sleeping or leaving the display to the firmware) and the bytes
+      allocated by the script per frame; all are deterministic.
+      Allocations CPython makes and MicroPython doesn't, e.g. for
+      "for x in range(...)" loops or ints > 256, are left out, while
+      float results count, which MicroPython allocates on the heap
+      but CPython mostly reuses. Some CPython allocations remain,
+      e.g. the bound __round__ method CPython looks up for round(),
+      so compare these figures between cases rather than reading
+      them as device numbers.
+      The device pass also reports the share of frames written
+      with display.show(), which drops below 100% for effects
+      skipping unchanged frames (see Case).
+
+    Usage:
+
+        python host/bench.py                      # run all cases
+        python host/bench.py -k blit              # cases matching 'blit'
+        python host/bench.py --save results.json
+        python host/bench.py --compare host/bench_baseline.json
+        python host/bench.py --soak 1000000       # long run check
+        python host/bench.py --zero-alloc         # allocation gate
+        python host/bench.py --check-replay       # balance on a trace
+        python host/bench.py --check-buttons      # button input layer
+
+    With --compare, the script exits with status 1 if a case's vfps
+    dropped or its allocations grew by more than --threshold percent.
+
+    --zero-alloc only runs the device pass of the hot cases, the effect
+    loops which are meant to run without allocating (see Case), and
+    exits with status 1 if any of them allocates after the warmup,
+    listing the lines which did. It also fails if it doesn't catch the
+    allocations of the calibration loops, one creating an Image and a
+    class instance per frame, the other computing floats.
+
+    --soak runs endless waves, computed for every frame, for the given
+    number of frames and exits with status 1 if the virtual frame time
+    varies by more than --threshold percent between the windows of
+    the run, or if the numbers the effect keeps grow from one window
+    to the next (e.g. an offset which makes math.sin() slow down
+    once it gets large, see waves-v1.py).
+
+    --check-replay runs balance on the replayed accelerometer trace
+    (lying still, tilted towards the top right, still again) and exits
+    with status 1 if the sensor doesn't settle to 0 and slow down while
+    still, doesn't speed up again on the tilt, or the drop doesn't
+    reach the top right corner.
+
+    --check-buttons polls Buttons on scripted presses of button A and
+    exits with status 1 if short presses don't count as one step each
+    (except for a bouncing button), or holding the button doesn't
+    make one long press with repeats speeding up to min_interval.
+
+"""
+import array
+import ctypes
+import dis
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, HOST_DIR)
+
+import microbit
+from microbit import emulator, EmulatorStop
+
+# Keep the harness itself out of the opcode counts
+microbit._untraced_files.add(os.path.abspath(__file__))
+
+### Cases
+
+class Case:
+
+    """ Benchmark case.
+
+        script is run for one frame to load its namespace (None
+        starts from an empty one), setup is then executed in that
+        namespace and call is evaluated there to run the effect.
+
+        Frames are counted as they are written to the display. For
+        effects which skip unchanged frames, frame names the function
+        or method (e.g. 'PointCache.blit') in the namespace which is
+        called once per frame; its calls are counted instead.
+
+        hot marks effect loops which must not allocate any memory
+        once they are running (see --zero-alloc).
+
+    """
+    def __init__(self, name, script, call, setup='', frame=None,
+                 hot=False):
+
+        self.name = name
+        self.script = script
+        self.call = call
+        self.setup = setup
+        self.frame = frame
+        self.hot = hot
+
+    def load(self):
+
+        """ Return a fresh namespace for running the case.
+
+        """
+        emulator.reset()
+        if self.script is None:
+            namespace = {'__name__': 'bench'}
+        else:
+            namespace = emulator.run_script(
+                os.path.join(REPO_DIR, self.script), frames=1)
+        exec(self.setup, namespace)
+        emulator.reset()
+        return namespace
+
+    def run(self, namespace, frames):
+
+        """ Run the case's call for the given number of frames.
+
+        """
+        emulator.stop_after(frames=frames)
+        if self.frame is not None:
+            # Wrap the frame function, so that each call counts as
+            # a frame, whether or not it writes to the display
+            path = self.frame.split('.')
+            owner = namespace
+            if len(path) > 1:
+                owner = namespace[path[0]]
+                for name in path[1:-1]:
+                    owner = getattr(owner, name)
+                function = getattr(owner, path[-1])
+            else:
+                function = namespace[path[0]]
+            counted = _count_frames(function)
+            if owner is namespace:
+                namespace[path[0]] = counted
+            else:
+                setattr(owner, path[-1], counted)
+            emulator.show_frames = False
+        try:
+            eval(self.call, namespace)
+        except EmulatorStop:
+            pass
+        finally:
+            emulator.max_frames = None
+            emulator.show_frames = True
+            if self.frame is not None:
+                # The owner may be a class shared with other cases
+                if owner is namespace:
+                    namespace[path[0]] = function
+                else:
+                    setattr(owner, path[-1], function)
+
+def _count_frames(function):
+
+    """ Return a wrapper of function which counts each call as a
+        frame.
+
+    """
+    def counted(*args, **kws):
+        result = function(*args, **kws)
+        emulator.frame(None)
+        return result
+    return counted
+
+# DeviceMeter recognizes the calls through the wrapper by its code
+_counted_code = _count_frames(None).__code__
+
+_layout_setup = '''
+def scroll_dim(display_class):
+    sd = display_class()
+    i = 0
+    while True:
+        sd.scroll_left()
+        sd.dim(0.8)
+        sd.set_dot(i % 5, 4)
+        sd.display()
+        i += 1
+'''
+
+# Drawing functions on their own: a point circling the center in 32
+# steps, drawn and shown on every frame with a display's show_point()
+# or written to the LED levels with alive.py's set_point(); the
+# positions are computed up front, so that only drawing them counts
+_point_setup = '''
+import math
+positions = [(2.0 + 1.5 * math.sin(i * math.pi / 16),
+              2.0 + 1.5 * math.cos(i * math.pi / 16))
+             for i in range(32)]
+def moving_point(display, level, scale):
+    i = 0
+    while True:
+        row, column = positions[i]
+        display.show_point(row, column, level, scale)
+        display.display(True)
+        i = (i + 1) % 32
+def set_points():
+    i = 0
+    while True:
+        row, column = positions[i]
+        set_point(row, column, 9, 5.0)
+        i = (i + 1) % 32
+'''
+
+# Several points circling the center, drawn with add_point()
+_orbit_setup = '''
+def orbit(count):
+    fd = FloatDisplay()
+    i = 0
+    while True:
+        fd.clear()
+        for point in range(count):
+            x = (i + 36 * point // count) * 2 * math.pi / 36
+            fd.add_point(2 + 1.5 * math.sin(x), 2 + 1.5 * math.cos(x),
+                         0.5, 1.0)
+        fd.display()
+        i += 1
+'''
+
+# Tilting the board in circles, so that the balance point keeps moving
+_tilt_setup = '''
+import math
+def tilted(effect, *args):
+    microbit.emulator.acceleration = lambda now: (
+        int(300 * math.sin(now / 700.0)), int(300 * math.cos(now / 500.0)),
+        -1024)
+    effect(*args)
+'''
+
+# A synthetic accelerometer trace, replayed like one recorded with
+# record.py: sensor noise of +-24 milli-g while the board lies flat,
+# tilted to the right from 2 to 3 s and towards the top from 2.5 to
+# 3.5 s, then lying flat again
+_replay_setup = '''
+import random
+noise = random.Random(1)
+trace = []
+for ms in range(0, 6000, 5):
+    x = 300 if 2000 <= ms < 3000 else 0
+    y = -200 if 2500 <= ms < 3500 else 0
+    trace.append((ms, x + noise.randint(-24, 24), y + noise.randint(-24, 24),
+                  -1024 + noise.randint(-24, 24)))
+def replayed(effect, *args):
+    microbit.emulator.replay(trace)
+    effect(*args)
+'''
+
+# Holding a button down, so that it repeats all the time
+_heap_setup = '''
+from profiler import HeapProfiler
+def profiled(effect, *args):
+    profiler = HeapProfiler()
+    try:
+        effect(*args, profiler=profiler)
+    finally:
+        profiler.stop()
+'''
+
+_held_setup = '''
+def held(button, effect, *args):
+    microbit.emulator.press(button, 0, 10 ** 9)
+    effect(*args)
+'''
+
+# Four 2x2 sprites moving across the display, drawn by adding one
+# full display per sprite vs. composing layers
+_sprites_setup = '''
+from compositor import Compositor, Layer
+def sprites_add(count):
+    sprite = SmartDisplay()
+    for row in range(2):
+        for column in range(2):
+            sprite.set_dot(row, column, 9 - 3 * row - column)
+    frame = SmartDisplay()
+    i = 0
+    while True:
+        frame.clear()
+        for s in range(count):
+            frame.add(sprite, -((i + s) % 4), -((i + 2 * s) % 4))
+        frame.display()
+        i += 1
+
+def sprites_compose(count):
+    layers = []
+    for s in range(count):
+        layer = Layer(2, 2)
+        for row in range(2):
+            for column in range(2):
+                layer.set_dot(row, column, 9 - 3 * row - column)
+        layers.append(layer)
+    compositor = Compositor()
+    i = 0
+    while True:
+        for s in range(count):
+            layers[s].move((i + s) % 4, (i + 2 * s) % 4)
+        compositor.display(layers)
+        i += 1
+'''
+
+# A point jumping to the next LED every steps frames
+_drift_setup = '''
+from fixeddisplay import FixedDisplay
+def drift(steps):
+    fd = FixedDisplay()
+    i = 0
+    while True:
+        fd.show_point(2.0, 1.0 + (i // steps) % 3, 1.0, 1.0)
+        fd.display()
+        i += 1
+'''
+
+cases = [
+    # Display blit strategies from waves-v3.py
+    Case('blit.image_string', 'waves-v3.py', 'waves(0)',
+         'display_leds = display_leds_image_string'),
+    Case('blit.image_array', 'waves-v3.py', 'waves(0)',
+         'display_leds = display_leds_image_array'),
+    Case('blit.set_pixel', 'waves-v3.py', 'waves(0)',
+         'display_leds = display_leds_set_pixel'),
+    # Effect loops
+    Case('waves', 'waves.py', 'waves(0)', hot=True),
+    # Playing the waves at 50 fps from Python vs. by the firmware
+    Case('waves.20', 'waves.py', 'waves(20)', hot=True),
+    Case('waves.firmware.20', 'waves.py', 'waves_firmware(20)', '''
+from animation import Animation
+def waves_firmware(delay):
+    Animation(render_waves, period=8).play(delay)
+    while True:
+        microbit.sleep(8 * delay)
+        if microbit.button_a.is_pressed():
+            delay = max(0, delay - 10)
+        if microbit.button_b.is_pressed():
+            delay += 10
+'''),
+    # Button A held: waves(0) stays at delay 0, but polls the button
+    # repeats
+    Case('waves.held', 'waves.py', "held('a', waves, 0)", _held_setup,
+         hot=True),
+    Case('snake', 'snake.py', 'snake(0)', hot=True),
+    # Not hot, like all loops computing with floats: MicroPython
+    # allocates each float result on the heap
+    Case('fsnake', 'fsnake.py', 'snake(0)'),
+    # Frame period of 50 ms, part of it spent rendering
+    Case('fsnake.50', 'fsnake.py', 'snake(50)'),
+    # Cost of recording the stage timings with the profiler
+    Case('profiler.waves', 'waves.py', 'waves(0, Profiler())',
+         'from profiler import Profiler', hot=True),
+    Case('profiler.fsnake', 'fsnake.py', 'snake(0, profiler=Profiler())',
+         'from profiler import Profiler'),
+    # Recording the allocations per frame as well, with automatic
+    # garbage collection disabled while the effect runs
+    Case('profiler.heap', 'fsnake.py', 'profiled(snake, 0)',
+         _heap_setup),
+    # The waves driven by the Runner vs. by their own loop
+    Case('runner.waves', None, 'Runner([waves_effect(0)]).run()',
+         'from runner import Runner\nfrom waves import waves_effect',
+         hot=True),
+    Case('heartbeat', 'alive.py', 'heartbeat(20)'),
+    # The functions drawing a point: set_point() of heartbeat(),
+    # which counts each call as a frame, and show_point() of the
+    # FloatDisplay of balance()
+    Case('set_point', 'alive.py', 'set_points()', _point_setup,
+         'set_point'),
+    Case('show_point.float', 'balance.py',
+         'moving_point(FloatDisplay(), 1.0, 1.0)', _point_setup),
+    # The same through the other display classes: the fixed point
+    # drop-in for FloatDisplay, and the integer level displays
+    Case('show_point.fixed', None,
+         'moving_point(FixedDisplay(), 1.0, 1.0)',
+         'from fixeddisplay import FixedDisplay\n' + _point_setup),
+    Case('show_point.smart', 'snake.py',
+         'moving_point(SmartDisplay(), 9, 5.0)', _point_setup),
+    Case('show_point.flat', None,
+         'moving_point(FlatDisplay(), 9, 5.0)',
+         'from flatdisplay import FlatDisplay\n' + _point_setup),
+    # Held still, balance() only renders the first frame and then
+    # reads the tilt sensor at its slow rate; the balance() cases
+    # count the sensor updates as frames
+    Case('balance.still', 'balance.py', 'balance(0.5)',
+         frame='TiltSensor.update'),
+    Case('balance.tilted', 'balance.py', 'tilted(balance, 0.5)',
+         _tilt_setup, 'TiltSensor.update'),
+    # Sensor noise, tilting and lying still from a replayed trace
+    Case('balance.replay', 'balance.py', 'replayed(balance, 0.5)',
+         _replay_setup, 'TiltSensor.update'),
+    # The same with separate tasks sampling the sensor every 10 ms,
+    # showing the drop every 40 ms and checking the buttons
+    Case('balance.async', 'balance.py', 'balance_async()',
+         frame='PointCache.blit'),
+    Case('balance.async.tilted', 'balance.py', 'tilted(balance_async)',
+         _tilt_setup, 'PointCache.blit'),
+    Case('points.sine_point', 'points.py', 'sines(0)'),
+    Case('points.orbit', 'fsnake.py', 'orbit(4)', _orbit_setup),
+    # FloatDisplay vs. fixed point FixedDisplay
+    Case('fsnake.fixed', 'fsnake.py', 'snake(0)',
+         'from fixeddisplay import FixedDisplay as FloatDisplay'),
+    Case('balance.fixed', 'balance.py', 'balance(0.5)',
+         'from fixeddisplay import FixedDisplay as FloatDisplay',
+         'TiltSensor.update'),
+    # Dirty frame detection: a point moving on every frame vs. every
+    # 10th frame, where the display skips the repeated frames
+    Case('dirty.drift.1', None, 'drift(1)', _drift_setup,
+         'FixedDisplay.display'),
+    Case('dirty.drift.10', None, 'drift(10)', _drift_setup,
+         'FixedDisplay.display'),
+    # Display layouts: scrolling, dimming and drawing on the row list
+    # SmartDisplay vs. the flat frame buffer
+    Case('layout.rows', 'snake.py', 'scroll_dim(SmartDisplay)',
+         _layout_setup),
+    Case('layout.flat', 'snake.py', 'scroll_dim(FlatDisplay)',
+         'from flatdisplay import FlatDisplay\n' + _layout_setup),
+    # Sprites: one add() per sprite vs. the compositor
+    Case('sprites.add', 'snake.py', 'sprites_add(4)', _sprites_setup),
+    Case('sprites.compose', 'snake.py', 'sprites_compose(4)',
+         _sprites_setup, hot=True),
+    ]
+
+# Scrolling a wave train drawn once onto canvases of growing width;
+# the cost per frame should not depend on the width
+_canvas_setup = '''
+import math
+from canvas import Canvas
+def wave_train(width):
+    canvas = Canvas(width)
+    for column in range(width):
+        y = math.sin(column * 2 * math.pi / 9)
+        canvas.set_dot(round(2 + 2 * y), column)
+    while True:
+        canvas.scroll()
+        canvas.display()
+'''
+cases.extend(Case('canvas.%i' % width, None, 'wave_train(%i)' % width,
+                  _canvas_setup, hot=True)
+             for width in (50, 500, 5000))
+
+# Endless waves computed for every frame, advancing the oscillator
+# forever; used by --soak
+_soak_case = Case('soak.waves', 'waves.py', 'live_waves()', '''
+def live_waves():
+    levels = bytearray(25)
+    while True:
+        for row in range(5):
+            level = wave.sample(row) + 4
+            for i in range(row * 5, row * 5 + 5):
+                levels[i] = level
+        microbit.display.show(microbit.Image(5, 5, levels))
+        wave.next()
+''')
+
+# balance() on the replayed trace, keeping its TiltSensor and logging
+# the sensor state after each .update() as (ms, x, y, interval); used
+# by --check-replay
+_replay_check_case = Case('check.replay', 'balance.py',
+                          'replayed(balance, 0.5)', _replay_setup + '''
+sensors = []
+sensor_log = []
+class LoggedSensor(TiltSensor):
+    def __init__(self, *args, **kws):
+        super().__init__(*args, **kws)
+        sensors.append(self)
+    def update(self):
+        moved = super().update()
+        sensor_log.append((self.now, self.x, self.y, self.interval))
+        return moved
+TiltSensor = LoggedSensor
+''')
+
+# Buttons polled on every frame, logging the steps and long presses
+# of button A as (ms, steps, long_press); used by --check-buttons
+_buttons_check_case = Case('check.buttons', None, 'poll_buttons()', '''
+import microbit
+from buttons import Buttons
+button_log = []
+def poll_buttons():
+    buttons = Buttons()
+    a = buttons.a
+    while True:
+        if buttons.poll() and (a.steps or a.long_press):
+            button_log.append((microbit.running_time(), a.steps,
+                               a.long_press))
+        microbit.sleep(10)
+''')
+
+# Bouncing particles; the cost per frame should grow with the number
+# of particles, not with the display size
+_particles_setup = '''
+from particles import Particles
+def fireflies(count):
+    particles = Particles(count, bounce=True)
+    for i in range(count):
+        particles.emit(i * 7 % 5, i * 3 % 5,
+                       (i % 7 - 3) / 10.0, (i % 5 - 2) / 8.0,
+                       0.3 + (i % 4) / 5.0)
+    while True:
+        particles.step()
+        particles.display()
+'''
+cases.extend(Case('particles.%i' % count, None, 'fireflies(%i)' % count,
+                  _particles_setup, hot=count <= 10)
+             for count in (1, 10, 50, 100, 200))
+
+# Reference loop which shows the same image over and over; used to
+# calibrate the allocation measurements
+_null_case = Case('null', None, 'null_effect()', '''
+import microbit
+def null_effect():
+    img = microbit.Image()
+    while True:
+        microbit.display.show(img)
+        microbit.sleep(0)
+''')
+
+# Loop which allocates an Image and a class instance per frame; the
+# --zero-alloc gate only passes if it catches these
+_alloc_case = Case('calibration.alloc', None, 'alloc_effect()', '''
+import microbit
+class Sprite:
+    def __init__(self, x):
+        self.x = x
+def alloc_effect():
+    buf = bytearray(25)
+    while True:
+        sprite = Sprite(1)
+        microbit.display.show(microbit.Image(5, 5, buf))
+        microbit.sleep(0)
+''')
+
+# Loop which computes 50 floats per frame; CPython takes them from
+# its free list of floats, which tracemalloc doesn't see, so the
+# --zero-alloc gate only passes if the meter counts them by type
+_float_case = Case('calibration.float', None, 'float_effect()', '''
+import microbit
+def float_effect():
+    img = microbit.Image()
+    row = [0.5] * 25
+    while True:
+        for c in range(25):
+            row[c] *= 0.9
+            row[c] += 0.1
+        microbit.display.show(img)
+        microbit.sleep(0)
+''')
+
+### Measurements
+
+# Opcodes whose allocations are ignored: MicroPython keeps the
+# iterator of a for loop on the stack and compiles "for x in
+# range(...)" into a plain counter loop, while CPython allocates
+# iterator and range objects
+_iter_opcodes = {dis.opmap[name]
+                 for name in ('GET_ITER', 'FOR_ITER')
+                 if name in dis.opmap}
+_call_opcodes = {dis.opmap[name]
+                 for name in ('CALL', 'PRECALL', 'CALL_FUNCTION')
+                 if name in dis.opmap}
+_get_iter = dis.opmap['GET_ITER']
+
+# Allocations of this size by call opcodes are ignored: while
+# tracing, CPython binds C methods (e.g. dict.get) to a new method
+# object on each call, MicroPython calls them directly
+_method_size = sys.getsizeof({}.get)
+
+# Allocations of a single int object by these opcodes are ignored as
+# well: MicroPython stores ints below 2**30 inline, CPython allocates
+# all ints above 256 (taking 28 or 32 bytes, depending on the version)
+_int_sizes = {sys.getsizeof(1 << 16), 32}
+_int_opcodes = _call_opcodes | {dis.opmap[name]
+                                for name in ('BINARY_OP', 'BINARY_SUBSCR',
+                                             'UNARY_NEGATIVE', 'INPLACE_ADD',
+                                             'BINARY_ADD', 'BINARY_MULTIPLY')
+                                if name in dis.opmap}
+
+# Opcodes whose allocations are ignored since they can't allocate:
+# CPython copies the locals of a frame to its f_locals dict on every
+# trace event, which grows the dict after a new local was bound
+_store_opcodes = {dis.opmap[name]
+                  for name in ('STORE_FAST', 'DELETE_FAST')
+                  if name in dis.opmap}
+
+# Opcodes which may return a new float object. CPython reuses the
+# float objects freed last, taking them from a free list without
+# tracemalloc noticing, while MicroPython allocates each float on the
+# heap, so a float on top of the stack after one of these counts as
+# allocated (see _returns_float()). Calls returning one of their
+# arguments (e.g. max()) count as well.
+_float_opcodes = _call_opcodes | {dis.opmap[name]
+                                  for name in ('BINARY_OP',
+                                               'UNARY_NEGATIVE',
+                                               'BINARY_ADD',
+                                               'BINARY_MULTIPLY',
+                                               'BINARY_TRUE_DIVIDE',
+                                               'INPLACE_ADD',
+                                               'INPLACE_MULTIPLY')
+                                  if name in dis.opmap}
+_float_size = sys.getsizeof(0.0)
+_float_type = id(float)
+
+# Offsets into the frame structs of 64-bit CPython 3.11 and 3.12: the
+# frame object points to its _PyInterpreterFrame, whose localsplus
+# array of locals is followed by the value stack; stacktop counts
+# the entries of both and is kept up to date while tracing
+_frame_data_offset = 24
+_stacktop_offset = 64
+_localsplus_offset = 72
+
+def _returns_float(frame):
+
+    """ Return True if the value on top of frame's stack is a float.
+
+    """
+    data = ctypes.c_void_p.from_address(id(frame) +
+                                        _frame_data_offset).value
+    top = ctypes.c_int.from_address(data + _stacktop_offset).value
+    if top <= frame.f_code.co_nlocals:
+        return False
+    value = ctypes.c_void_p.from_address(
+        data + _localsplus_offset + 8 * (top - 1)).value
+    return ctypes.c_void_p.from_address(value + 8).value == _float_type
+
+# Code flags of generators and coroutines, whose frame objects live
+# as long as the generator, see DeviceMeter.discard()
+_generator_flags = (inspect.CO_GENERATOR | inspect.CO_COROUTINE |
+                    inspect.CO_ASYNC_GENERATOR)
+
+class DeviceMeter:
+
+    """ Allocation probe and frame hook recording the opcodes, the
+        virtual time and the bytes allocated by the script per
+        frame.
+
+        The emulator pauses the probe while running its own
+        bookkeeping. In between, the growth of the memory traced by
+        tracemalloc is summed up per opcode, including the calls into
+        the emulator an opcode makes (e.g. creating an Image), and
+        opcodes which allocated count with what they allocated, so
+        garbage created and freed again within a frame is counted as
+        well; only objects freed again within the same opcode are
+        not. Allocations CPython makes for for loops and small ints
+        are left out (see _iter_opcodes and _int_opcodes). Floats,
+        which CPython mostly takes from a free list, are counted by
+        type instead (see _float_opcodes).
+
+        So are the frame objects CPython creates for Python calls
+        while tracing, which MicroPython doesn't (see .discard()),
+        and the growth of the frames' f_locals dicts, which CPython
+        updates on each trace event (see _store_opcodes).
+
+    """
+    def __init__(self, warmup):
+
+        self.warmup = warmup
+        self.samples = []
+        self.allocated = 0
+        self.paused = True
+        # Storing these in an array doesn't leave a new int object
+        # behind, which would count as allocation
+        self.base = array.array('q', [0])
+        self.op_allocated = array.array('q', [0])
+        self.last_op = 0
+        self.last_frame = 0
+        self.co_code = {}
+        self.start = None
+        # If set to a dict, the bytes allocated after the warmup are
+        # summed up there per (filename, line number) as well
+        self.sites = None
+        self.last_code = None
+        self.last_line = 0
+        # Frames of the generators entered so far, by id
+        self.generator_frames = {}
+        # Both run ._switch(), see there
+        self.pause = functools.partial(self._switch, True)
+        self.resume = functools.partial(self._switch, False)
+
+    def _switch(self, paused):
+
+        """ Pause or resume recording allocations.
+
+            The emulator calls .pause() and .resume() from its own
+            functions, so CPython creates a frame object for each
+            call. The one of .pause() is created while recording and
+            freed while paused, the one of .resume() the other way
+            around; since both run this code, they have the same size
+            and cancel out.
+
+        """
+        if paused == self.paused:
+            return
+        self.paused = paused
+        if paused:
+            # Read first: loading .op_allocated[0] creates an int
+            # object unless it's small
+            current = tracemalloc.get_traced_memory()[0]
+            self.op_allocated[0] += current - self.base[0]
+        else:
+            self.base[0] = tracemalloc.get_traced_memory()[0]
+
+    def discard(self, frame):
+
+        """ Drop the frame object CPython allocated for entering
+            frame, a function of the script, from the allocations
+            recorded for the current opcode.
+
+            The object is freed again when the function returns,
+            which doesn't count, see .opcode(). Frames of the
+            emulator's functions are created and freed within the
+            same opcode of the script and cancel out. Generators keep
+            their frame object, so only their first resume allocates
+            one.
+
+        """
+        if self.paused:
+            return
+        caller = frame.f_back
+        if caller is not None and caller.f_code is _counted_code:
+            # The wrapper's frame object and arguments belong to the
+            # harness, so drop everything allocated for the call
+            current = tracemalloc.get_traced_memory()[0]
+            self.op_allocated[0] = self.base[0] - current
+            return
+        if frame.f_code.co_flags & _generator_flags:
+            key = id(frame)
+            if key in self.generator_frames:
+                return
+            # Keeping the frame alive keeps its id from being reused
+            self.generator_frames[key] = frame
+        self.op_allocated[0] -= sys.getsizeof(frame)
+
+    def opcode(self, frame):
+
+        """ Account the allocations since the last call to the
+            previous opcode and start recording for the next one.
+
+        """
+        code = frame.f_code
+        co_code = self.co_code.get(code)
+        if co_code is None:
+            # .co_code creates a new bytes object on each access
+            co_code = self.co_code[code] = code.co_code
+        op = co_code[frame.f_lasti]
+        last_op = self.last_op
+        key = id(frame)
+        allocated = self.op_allocated[0]
+        # Opcodes freeing more than they allocate don't count
+        if allocated <= 0 or (last_op in _iter_opcodes or
+                last_op in _store_opcodes or
+                (last_op in _call_opcodes and
+                 (op == _get_iter or allocated == _method_size)) or
+                (last_op in _int_opcodes and allocated in _int_sizes)):
+            allocated = 0
+        # The last opcode ran in this frame, rather than calling a
+        # function of the script
+        if (allocated < _float_size and last_op in _float_opcodes and
+                key == self.last_frame and _returns_float(frame)):
+            allocated = _float_size
+        if allocated:
+            self.allocated += allocated
+            sites = self.sites
+            if allocated and sites is not None and self.warmup < 0:
+                site = (self.last_code.co_filename, self.last_line)
+                sites[site] = sites.get(site, 0) + allocated
+        self.op_allocated[0] = 0
+        self.last_op = op
+        self.last_frame = key
+        self.last_code = code
+        self.last_line = frame.f_lineno
+
+    def __call__(self, image):
+
+        if self.warmup == 0:
+            self.start = (emulator.now, emulator.opcodes, emulator.busy,
+                          emulator.calls['display.show'])
+        elif self.warmup < 0:
+            self.samples.append(self.allocated)
+        self.warmup -= 1
+        self.allocated = 0
+
+    def results(self):
+
+        """ Return (vfps, opcodes per frame, bytes per frame, busy
+            percentage, percentage of frames shown) for the frames
+            after the warmup.
+
+        """
+        frames = len(self.samples)
+        start_time, start_opcodes, start_busy, start_shows = self.start
+        elapsed = emulator.now - start_time
+        return (frames / (elapsed / 1e6),
+                (emulator.opcodes - start_opcodes) / frames,
+                sum(self.samples) / frames,
+                (emulator.busy - start_busy) * 100.0 / elapsed,
+                (emulator.calls['display.show'] - start_shows) * 100.0
+                / frames)
+
+def measure_wall(case, frames):
+
+    namespace = case.load()
+    t0 = time.perf_counter()
+    case.run(namespace, frames)
+    t1 = time.perf_counter()
+    return emulator.frames / (t1 - t0)
+
+def measure_device(case, frames, warmup=10, sites=None):
+
+    """ Run case with opcode tracing and allocation probe.
+
+        Returns (vfps, opcodes per frame, bytes per frame, busy
+        percentage, percentage of frames shown). If sites is given,
+        the bytes allocated are added up there per (filename, line
+        number), see DeviceMeter.sites.
+
+    """
+    namespace = case.load()
+    meter = DeviceMeter(warmup)
+    meter.sites = sites
+    emulator.frame_hooks.append(meter)
+    emulator.probe = meter
+    tracemalloc.start()
+    emulator.trace_opcodes()
+    meter.resume()
+    try:
+        case.run(namespace, frames + warmup + 1)
+    finally:
+        emulator.trace_opcodes(False)
+        tracemalloc.stop()
+        emulator.probe = None
+    return meter.results()
+
+def run_case(case, frames, alloc_overhead=0.0):
+
+    """ Run all passes for case and return a result dict.
+
+    """
+    vfps, opcodes, alloc, busy, shown = measure_device(case, frames)
+    alloc -= alloc_overhead
+    return {
+        'wall_fps': round(measure_wall(case, frames), 1),
+        'vfps': round(vfps, 2),
+        'opcodes_per_frame': round(opcodes, 1),
+        'alloc_bytes_per_frame': round(max(alloc, 0.0), 1),
+        'busy_pct': round(busy, 1),
+        'shown_pct': round(shown, 1),
+        }
+
+def run(selected, frames):
+
+    results = {}
+    overhead = measure_device(_null_case, frames)[2]
+    for case in selected:
+        results[case.name] = result = run_case(case, frames, overhead)
+        print('%-20s %9.1f wall fps %7.2f vfps %7.1f ops/frame '
+              '%7.1f bytes/frame %5.1f%% busy %5.1f%% shown' % (
+                  case.name, result['wall_fps'], result['vfps'],
+                  result['opcodes_per_frame'],
+                  result['alloc_bytes_per_frame'],
+                  result['busy_pct'], result['shown_pct']))
+    return results
+
+def zero_alloc(selected, frames, overhead):
+
+    """ Run the hot cases in selected with the allocation probe and
+        return a list of messages for those allocating memory after
+        the warmup, naming the lines which allocated.
+
+    """
+    failures = []
+    # A meter which misses allocations passes every case
+    for case in (_alloc_case, _float_case):
+        alloc = measure_device(case, frames)[2] - overhead
+        print('%-20s %7.1f bytes/frame' % (case.name, max(alloc, 0.0)))
+        if round(alloc, 1) <= 0.0:
+            failures.append('%s: allocations of the calibration loop '
+                            'were not detected' % case.name)
+    for case in selected:
+        if not case.hot:
+            continue
+        sites = {}
+        alloc = measure_device(case, frames, sites=sites)[2] - overhead
+        print('%-20s %7.1f bytes/frame' % (case.name, max(alloc, 0.0)))
+        if round(alloc, 1) <= 0.0:
+            continue
+        lines = sorted(sites.items(), key=lambda item: -item[1])[:5]
+        failures.append('%s: %.1f bytes/frame allocated by %s' % (
+            case.name, alloc, ', '.join(
+                '%s:%i (%i bytes)' % (os.path.basename(filename),
+                                      line, total)
+                for (filename, line), total in lines)))
+    return failures
+
+def _magnitude(frame):
+
+    """ Return the largest absolute value of the ints and floats kept
+        by frame and the script frames calling it: in their locals,
+        the script's globals and the attributes of the objects these
+        refer to.
+
+    """
+    largest = 0
+    seen = set()
+    while frame is not None:
+        if frame.f_code.co_filename in microbit._untraced_files:
+            frame = frame.f_back
+            continue
+        for scope in (frame.f_locals, frame.f_globals):
+            for value in scope.values():
+                if isinstance(value, (types.ModuleType, type)):
+                    continue
+                if id(value) in seen:
+                    continue
+                seen.add(id(value))
+                values = [value]
+                if hasattr(value, '__dict__'):
+                    values.extend(vars(value).values())
+                for value in values:
+                    if (isinstance(value, (int, float)) and
+                            not isinstance(value, bool)):
+                        largest = max(largest, abs(value))
+        frame = frame.f_back
+    return largest
+
+def soak(case, frames, windows=10):
+
+    """ Run case for frames frames with opcode tracing and return
+        the virtual time per frame in us and the largest number the
+        effect keeps (see _magnitude()) for each of windows
+        consecutive windows.
+
+        The virtual time only depends on the work done per frame,
+        so a constant frame time shows that the cost does not grow
+        while the effect runs (unlike the wall time, which varies
+        with the host load). The emulator charges for the slower
+        math.sin() of large arguments (see REDUCE_LIMIT), but only
+        by a little per doubling, so the numbers are checked as
+        well: if they stay bounded, so does the cost.
+
+    """
+    namespace = case.load()
+    window = frames // windows
+    times = []
+    magnitudes = []
+    def hook(image):
+        if emulator.frames % window == 0:
+            times.append(emulator.now)
+            magnitudes.append(_magnitude(sys._getframe(1)))
+    emulator.frame_hooks.append(hook)
+    times.append(emulator.now)
+    emulator.trace_opcodes()
+    try:
+        case.run(namespace, window * windows)
+    finally:
+        emulator.trace_opcodes(False)
+    return ([(t1 - t0) / window for t0, t1 in zip(times, times[1:])],
+            magnitudes)
+
+def check_replay(case):
+
+    """ Run balance() on the replayed trace of case and return a list
+        of messages for the checks it fails.
+
+        The trace (see _replay_setup) lies flat until 2 s, tilts to
+        the right until 3 s and towards the top from 2.5 to 3.5 s,
+        then lies flat again until 6 s.
+
+    """
+    namespace = case.load()
+    # Frames shown as (ms, row, column) of the brightest LED
+    shown = []
+    def hook(image):
+        pixels = microbit.display._pixels
+        i = max(range(25), key=pixels.__getitem__)
+        shown.append((emulator.running_time(), i // 5, i % 5))
+    emulator.frame_hooks.append(hook)
+    emulator.stop_after(ms=6000)
+    emulator.trace_opcodes()
+    try:
+        eval(case.call, namespace)
+    except EmulatorStop:
+        pass
+    finally:
+        emulator.trace_opcodes(False)
+    log = namespace['sensor_log']
+    sensor = namespace['sensors'][0]
+    period = sensor.period
+    slow_period = sensor.slow_period
+    still_after = sensor.still_after
+    failures = []
+
+    def logged(start, end):
+        return [entry for entry in log if start <= entry[0] < end]
+
+    def frames(start, end):
+        return [frame for frame in shown if start <= frame[0] < end]
+
+    # The readings settle at 0 once the board lies flat again
+    if [entry for entry in logged(4000, 6000) if entry[1] or entry[2]]:
+        failures.append('x and y do not settle at 0 after the tilt')
+    # The sensor slows down while the board lies still, speeds up
+    # again on the tilt and slows down once it lies still again
+    before = logged(0, 2000)
+    slowed = [ms for ms, x, y, interval in before
+              if interval == slow_period]
+    if not slowed or slowed[0] < still_after:
+        failures.append('interval does not drop to %i ms after %i ms '
+                        'without movement' % (slow_period, still_after))
+    if [entry for entry in logged(2300, 3500) if entry[3] != period]:
+        failures.append('interval does not return to %i ms on the '
+                        'tilt' % period)
+    if [entry for entry in logged(5000, 6000)
+        if entry[3] != slow_period]:
+        failures.append('interval does not drop to %i ms again after '
+                        'the tilt' % slow_period)
+    # The drop rolls to the right edge, then to the top right corner
+    if not [frame for frame in frames(2000, 3000) if frame[2] == 4]:
+        failures.append('drop does not reach the right edge')
+    if not [frame for frame in frames(2500, 3500) if frame[1:] == (0, 4)]:
+        failures.append('drop does not reach the top right corner')
+    # While the board lies still, a noisy reading may move the drop
+    # for a few frames, but none are shown once the sensor slowed down
+    for start, end in ((0, 2000), (3500, 6000)):
+        count = len(frames(start, end))
+        slowed = [entry[0] for entry in logged(start, end)
+                  if entry[3] == slow_period]
+        late = slowed and len(frames(slowed[0], end))
+        if count > 3 or late:
+            failures.append('%i frames shown while lying still from '
+                            '%i to %i ms' % (count, start, end))
+    print('%-20s %i readings, %i frames shown' % (
+        case.name, sensor.readings, len(shown)))
+    return failures
+
+def check_buttons(case):
+
+    """ Run case on scripted presses of button A and return a list of
+        messages for the checks it fails.
+
+    """
+    def run(script, ms=1000):
+        namespace = case.load()
+        emulator.press_script(script)
+        emulator.stop_after(ms=ms)
+        try:
+            eval(case.call, namespace)
+        except EmulatorStop:
+            pass
+        log = namespace['button_log']
+        print('%-20s %-28s %3i steps' % (
+            case.name, script, sum(entry[1] for entry in log)))
+        return log
+
+    def steps(log, start=0, end=10 ** 9):
+        return sum(entry[1] for entry in log if start <= entry[0] < end)
+
+    failures = []
+    # Each short press is one step, however short the gap between
+    # them, unless the button only bounced
+    for script, expected in (('a@100', 1),
+                             ('a@100 a@300', 2),
+                             ('a@100+30 a@160+30 a@220+30', 3),
+                             ('a@100+30 a@140+30', 1),
+                             ('a@100 a@108', 1)):
+        log = run(script)
+        if steps(log) != expected:
+            failures.append('%s: %i steps instead of %i' % (
+                script, steps(log), expected))
+        if [entry for entry in log if entry[2]]:
+            failures.append('%s: counted as a long press' % script)
+    # Holding the button makes a long press after repeat_delay ms,
+    # then repeats the step faster and faster, until the repeats come
+    # every min_interval ms
+    log = run('a@100+2000', 2500)
+    longs = [entry[0] for entry in log if entry[2]]
+    if len(longs) != 1 or not 600 <= longs[0] < 700:
+        failures.append('long press at %s instead of once after 500 ms'
+                        % longs)
+    early = steps(log, 600, 1100)
+    late = steps(log, 1600, 2100)
+    if not early < late <= 500 // 30 + 1:
+        failures.append('repeats do not speed up to every 30 ms: %i '
+                        'steps from 600 to 1100 ms, %i from 1600 to '
+                        '2100 ms' % (early, late))
+    return failures
+
+def compare(results, baseline, threshold):
+
+    """ Compare results against baseline and return a list of
+        regression messages.
+
+    """
+    regressions = []
+    factor = threshold / 100.0
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result['vfps'] < old['vfps'] * (1.0 - factor):
+            regressions.append('%s: vfps dropped from %.2f to %.2f' % (
+                name, old['vfps'], result['vfps']))
+        # Allow for a few bytes of noise on allocation-free cases
+        limit = old['alloc_bytes_per_frame'] * (1.0 + factor) + 16
+        if result['alloc_bytes_per_frame'] > limit:
+            regressions.append(
+                '%s: allocations grew from %.1f to %.1f bytes/frame' % (
+                    name, old['alloc_bytes_per_frame'],
+                    result['alloc_bytes_per_frame']))
+    return regressions
+
+def main():
+
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='pattern', default='',
+                        help='only run cases containing this string')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='frames per pass')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='permitted regression in percent')
+    parser.add_argument('--zero-alloc', action='store_true',
+                        help='only check that the hot cases do not '
+                             'allocate once running')
+    parser.add_argument('--soak', type=int, metavar='FRAMES',
+                        help='run the soak case for this many frames '
+                             '(e.g. 1000000) and check that the frame '
+                             'time stays flat')
+    parser.add_argument('--check-replay', action='store_true',
+                        help='check how balance reacts to the replayed '
+                             'accelerometer trace')
+    parser.add_argument('--check-buttons', action='store_true',
+                        help='check the steps and long presses read '
+                             'from scripted button presses')
+    options = parser.parse_args()
+
+    if options.check_buttons:
+        failures = check_buttons(_buttons_check_case)
+        for message in failures:
+            print('CHECK %s' % message)
+        if failures:
+            sys.exit(1)
+        return
+
+    if options.check_replay:
+        failures = check_replay(_replay_check_case)
+        for message in failures:
+            print('CHECK %s' % message)
+        if failures:
+            sys.exit(1)
+        return
+
+    if options.soak:
+        times, magnitudes = soak(_soak_case, options.soak)
+        for i, (us, magnitude) in enumerate(zip(times, magnitudes)):
+            print('%-20s window %2i %9.2f us/frame  largest number %g' % (
+                _soak_case.name, i, us, magnitude))
+        growth = max(times) / min(times) - 1.0
+        print('%-20s frame time spread %.1f%%' % (
+            _soak_case.name, growth * 100.0))
+        failed = False
+        if growth * 100.0 > options.threshold:
+            print('REGRESSION %s: frame time grew by %.1f%%' % (
+                _soak_case.name, growth * 100.0))
+            failed = True
+        if max(magnitudes) > magnitudes[0]:
+            print('REGRESSION %s: numbers grew from %g to %g' % (
+                _soak_case.name, magnitudes[0], max(magnitudes)))
+            failed = True
+        if failed:
+            sys.exit(1)
+        return
+
+    selected = [case for case in cases if options.pattern in case.name]
+    if options.zero_alloc:
+        overhead = measure_device(_null_case, options.frames)[2]
+        failures = zero_alloc(selected, options.frames, overhead)
+        for message in failures:
+            print('ALLOCATION %s' % message)
+        if failures:
+            sys.exit(1)
+        return
+
+    results = run(selected, options.frames)
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.threshold)
+        for message in regressions:
+            print('REGRESSION %s' % message)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
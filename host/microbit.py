@@ -0,0 +1,897 @@
+""" Host-side stand-in for the micro:bit MicroPython microbit module.
+
+    Put the host/ directory in front of sys.path and the scripts in
+    this repository run unchanged on a normal Python installation,
+    e.g. on a Linux CI box:
+
+        python host/microbit.py --frames 100 --show snake.py
+
+    Time is virtual: every API call advances a deterministic clock by
+    a configurable cost (see Emulator.costs), sleep() simply moves the
+    clock forward and running_time() reads it. Optionally, each Python
+    bytecode executed by the script can be charged as well, which
+    gives a reproducible estimate of the interpreter time a frame
+    takes on the device.
+
+    display.show(iterable, wait=False) plays the images in the
+    background, like the firmware does: frames are shown at their
+    virtual time while the clock advances, e.g. during sleep(). The
+    emulator's .busy counter tells how much of the virtual time was
+    spent running Python code and API calls, rather than sleeping.
+
+    Since all effects run in endless loops, the emulator can be told
+    to stop after a number of frames or after some amount of virtual
+    time; it then raises EmulatorStop. A frame is a display.show()
+    call or a sleep() following display.set_pixel() updates.
+
+"""
+import bisect
+import gc
+import math
+import os
+import sys
+import tracemalloc
+
+### Emulator state
+
+class EmulatorStop(BaseException):
+
+    """ Raised by the emulator to end a script's endless loop.
+
+        Derived from BaseException, so that scripts catching
+        Exception don't swallow it.
+
+    """
+
+class Emulator:
+
+    # Default cost of the microbit API calls in microseconds. These
+    # are rough figures fitted to the display_leds_image_array and
+    # display_leds_set_pixel timings noted in waves-v3.py; Image()
+    # includes the amortized garbage collection of the allocated
+    # image. Adjust them via .costs to model a different device.
+    default_costs = {
+        # Charged per Python bytecode, if opcode tracing is enabled
+        'opcode': 25,
+        'Image': 4500,
+        'Image.str': 15000,
+        'Image.get_pixel': 50,
+        'Image.set_pixel': 50,
+        'Image.copy': 4500,
+        'display.show': 1250,
+        'display.set_pixel': 100,
+        'display.get_pixel': 50,
+        'display.clear': 200,
+        'running_time': 10,
+        'ticks': 10,
+        'button': 30,
+        'accelerometer': 250,
+        'gc.mem_free': 10,
+        'gc.collect': 2000,
+        # Charged per doubling of the argument of math.sin() and
+        # math.cos() above REDUCE_LIMIT
+        'math.reduce': 100,
+        }
+
+    def __init__(self):
+
+        self.costs = dict(self.default_costs)
+        # Bound once, since creating a new bound method on every
+        # opcode would show up as allocation
+        self._opcode_tracer = self._trace_opcode
+        self.reset()
+
+    def reset(self):
+
+        """ Reset the emulator to its power-on state.
+
+            The cost table is kept.
+
+        """
+        # Virtual clock in microseconds and the part of it spent in
+        # API calls and bytecodes, i.e. not sleeping or waiting
+        self.now = 0
+        self.busy = 0
+        # Number of calls per API function
+        self.calls = dict.fromkeys(self.default_costs, 0)
+        # Number of frames shown and callables run on each frame,
+        # as hook(image); image may also be the display itself or
+        # None for frames counted by the caller (see show_frames)
+        self.frames = 0
+        self.frame_hooks = []
+        # If false, writing to the display doesn't count as frame;
+        # the caller then counts the frames by calling .frame()
+        # itself, e.g. for scripts skipping unchanged frames
+        self.show_frames = True
+        # Stop conditions
+        self.max_frames = None
+        self.max_time = None
+        # Opcode tracing
+        self.opcodes = 0
+        self.tracing = False
+        # Allocation probe: object with .pause() and .resume()
+        # methods, called when entering and leaving emulator
+        # bookkeeping, so that its allocations can be told apart
+        # from those of the script, and a .paused attribute; when
+        # tracing opcodes, its .opcode(frame) method is called for
+        # every bytecode run while recording and .discard(frame) on
+        # every call of a script function
+        self.probe = None
+        # LED state
+        display._pixels = bytearray(25)
+        display._dirty = False
+        display._player = None
+        # Button presses as list of (start, end) times in ms
+        button_a._presses = []
+        button_a._counted = 0
+        button_b._presses = []
+        button_b._counted = 0
+        # Accelerometer source: callable(ms) -> (x, y, z)
+        self.acceleration = lambda now: (0, 0, -1024)
+        # Traced memory gc.mem_alloc() counts from; None takes the
+        # figure on the next call
+        self.heap_base = None
+        # Modeled heap use and the traced memory at the last
+        # gc.mem_alloc() call, in bytes
+        self.heap_used = 0
+        self.heap_level = 0
+
+    def stop_after(self, frames=None, ms=None):
+
+        """ Stop the running script with EmulatorStop after the
+            given number of frames and/or milliseconds of virtual
+            time, counted from now.
+
+        """
+        if frames is not None:
+            self.max_frames = self.frames + frames
+        if ms is not None:
+            self.max_time = self.now + ms * 1000
+
+    def advance(self, us):
+
+        """ Advance the virtual clock by us microseconds.
+
+            Frames of a background animation which are due in
+            the meantime are shown at their time.
+
+        """
+        target = self.now + us
+        if display._player is not None:
+            display._play(target)
+        if target > self.now:
+            self.now = target
+        if self.max_time is not None and self.now >= self.max_time:
+            raise EmulatorStop('time limit reached')
+
+    def charge(self, name):
+
+        """ Account for a call to the API function name.
+
+        """
+        probe = self.probe
+        if probe is not None:
+            probe.pause()
+        self.calls[name] += 1
+        cost = self.costs[name]
+        self.busy += cost
+        self.advance(cost)
+        if probe is not None:
+            probe.resume()
+
+    def running_time(self):
+
+        """ Return the virtual time in ms.
+
+        """
+        return self.now // 1000
+
+    def frame(self, image):
+
+        """ Record a frame written to the display.
+
+        """
+        probe = self.probe
+        if probe is not None:
+            probe.pause()
+        self.frames += 1
+        for hook in self.frame_hooks:
+            hook(image)
+        if self.max_frames is not None and self.frames >= self.max_frames:
+            raise EmulatorStop('frame limit reached')
+        if probe is not None:
+            probe.resume()
+
+    def press(self, buttons, at, duration=50):
+
+        """ Schedule a press of buttons ('a', 'b' or 'ab' for both)
+            at virtual time at (in ms) lasting duration ms.
+
+            Like the MB firmware, which filters the button input, a
+            press starting less than BUTTON_DEBOUNCE ms after the end
+            of the previous one counts as bouncing of that one.
+
+        """
+        for name in buttons:
+            button = {'a': button_a, 'b': button_b}[name]
+            presses = []
+            for start, end in sorted(button._presses +
+                                     [(at, at + duration)]):
+                if presses and start < presses[-1][1] + BUTTON_DEBOUNCE:
+                    presses[-1] = (presses[-1][0], max(end, presses[-1][1]))
+                else:
+                    presses.append((start, end))
+            button._presses = presses
+
+    def press_script(self, script):
+
+        """ Schedule the button presses given as script, e.g.
+            'a@1000 ab@2500+800': buttons, '@', the time in ms and
+            optionally '+' and the duration in ms, separated by
+            spaces or commas.
+
+        """
+        for event in script.replace(',', ' ').split():
+            buttons, _, times = event.partition('@')
+            at, _, duration = times.partition('+')
+            self.press(buttons, int(at), int(duration or 50))
+
+    def tilt(self, x=0, y=0, z=-1024):
+
+        """ Hold the board still at the given accelerometer
+            readings (in milli-g).
+
+        """
+        self.acceleration = lambda now: (x, y, z)
+
+    def replay(self, samples):
+
+        """ Replay the accelerometer readings samples, a list of
+            (ms, x, y, z) tuples ordered by time, e.g. recorded on the
+            device with record.py.
+
+            Each reading holds until the time of the next one; the
+            first one holds before its time, the last one for the
+            rest of the run. Times are relative to the start of the
+            run.
+
+        """
+        samples = [tuple(sample) for sample in samples]
+        times = [sample[0] for sample in samples]
+        readings = [sample[1:] for sample in samples]
+        def acceleration(now):
+            index = bisect.bisect_right(times, now) - 1
+            if index < 0:
+                index = 0
+            return readings[index]
+        self.acceleration = acceleration
+
+    def load_trace(self, filename):
+
+        """ Replay the accelerometer trace in filename, written by
+            record.py: one "ms,x,y,z" line per reading.
+
+            Lines which don't look like readings (e.g. the MicroPython
+            banner captured from the serial console) are skipped.
+
+        """
+        samples = []
+        with open(filename) as trace:
+            for line in trace:
+                fields = line.strip().split(',')
+                if len(fields) != 4:
+                    continue
+                try:
+                    samples.append(tuple(int(field) for field in fields))
+                except ValueError:
+                    continue
+        if not samples:
+            raise ValueError('no readings found in %r' % filename)
+        # record.py writes the device's running_time(); start the
+        # replay with the first reading
+        start = samples[0][0]
+        self.replay([(ms - start, x, y, z) for ms, x, y, z in samples])
+
+    ### Opcode tracing
+
+    def trace_opcodes(self, enable=True):
+
+        """ Enable or disable charging the 'opcode' cost for each
+            bytecode executed outside of this module.
+
+            This slows down the host a lot, but makes the virtual
+            clock reflect the Python work done by the script.
+
+        """
+        if enable:
+            sys.settrace(self._trace)
+        else:
+            sys.settrace(None)
+        self.tracing = enable
+
+    def _trace(self, frame, event, arg):
+
+        # Called on entering a new Python frame; CPython has just
+        # created a frame object for it, which MicroPython doesn't
+        probe = self.probe
+        if frame.f_code.co_filename in _untraced_files:
+            return None
+        if probe is not None:
+            probe.discard(frame)
+        frame.f_trace_lines = False
+        frame.f_trace_opcodes = True
+        return self._opcode_tracer
+
+    def _trace_opcode(self, frame, event, arg):
+
+        if event == 'opcode':
+            probe = self.probe
+            if probe is not None and probe.paused:
+                # Script code called back by the emulator's own
+                # bookkeeping (e.g. a replaced .acceleration) is
+                # part of that
+                probe = None
+            if probe is not None:
+                probe.pause()
+            self.opcodes += 1
+            cost = self.costs['opcode']
+            self.now += cost
+            self.busy += cost
+            if probe is not None:
+                probe.opcode(frame)
+                probe.resume()
+        return self._opcode_tracer
+
+    ### Running scripts
+
+    def run_script(self, path, frames=None, ms=None):
+
+        """ Run the script at path until it returns or one of the
+            stop conditions is reached.
+
+            Returns the script's global namespace, so that its
+            functions and classes can be used afterwards.
+
+        """
+        with open(path) as f:
+            code = compile(f.read(), path, 'exec')
+        namespace = {'__name__': '__main__', '__file__': path}
+        self.stop_after(frames, ms)
+        try:
+            exec(code, namespace)
+        except EmulatorStop:
+            pass
+        finally:
+            self.max_frames = None
+            self.max_time = None
+        return namespace
+
+### Images
+
+def _check_brightness(value):
+
+    if not 0 <= value <= 9:
+        raise ValueError('brightness out of bounds')
+
+class Image:
+
+    """ Image with brightness levels 0-9 per pixel.
+
+        Supports the constructor forms Image(), Image(string),
+        Image(width, height) and Image(width, height, buffer).
+        The buffer is copied, as on the device.
+
+    """
+    def __init__(self, *args):
+
+        if not args or not isinstance(args[0], str):
+            emulator.charge('Image')
+        else:
+            emulator.charge('Image.str')
+        if not args:
+            width, height, pixels = 5, 5, bytearray(25)
+        elif isinstance(args[0], str):
+            rows = args[0].replace('\n', ':').rstrip(':').split(':')
+            width = max(len(row) for row in rows)
+            height = len(rows)
+            pixels = bytearray(width * height)
+            for y, row in enumerate(rows):
+                for x, c in enumerate(row):
+                    if not c.isdigit():
+                        raise ValueError('unexpected character in Image definition')
+                    pixels[y * width + x] = int(c)
+        else:
+            width, height = args[0], args[1]
+            if width < 0 or height < 0:
+                raise ValueError('image width and height must be positive')
+            if len(args) > 2:
+                pixels = bytearray(args[2])
+                if len(pixels) != width * height:
+                    raise ValueError('image data is incorrect size')
+                if max(pixels, default=0) > 9:
+                    raise ValueError('brightness out of bounds')
+            else:
+                pixels = bytearray(width * height)
+        self._width = width
+        self._height = height
+        self._pixels = pixels
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def _index(self, x, y):
+
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            raise ValueError('index out of bounds')
+        return y * self._width + x
+
+    def get_pixel(self, x, y):
+
+        emulator.charge('Image.get_pixel')
+        return self._pixels[self._index(x, y)]
+
+    def set_pixel(self, x, y, value):
+
+        emulator.charge('Image.set_pixel')
+        _check_brightness(value)
+        self._pixels[self._index(x, y)] = value
+
+    def fill(self, value):
+
+        _check_brightness(value)
+        pixels = self._pixels
+        for i in range(len(pixels)):
+            pixels[i] = value
+
+    def copy(self):
+
+        emulator.charge('Image.copy')
+        return Image(self._width, self._height, self._pixels)
+
+    def blit(self, src, x, y, w, h, xdest=0, ydest=0):
+
+        """ Copy the w x h rectangle at (x, y) from src to
+            (xdest, ydest) in this image. Pixels outside src
+            read as 0.
+
+        """
+        for dy in range(h):
+            for dx in range(w):
+                sx, sy = x + dx, y + dy
+                if 0 <= sx < src._width and 0 <= sy < src._height:
+                    value = src._pixels[sy * src._width + sx]
+                else:
+                    value = 0
+                tx, ty = xdest + dx, ydest + dy
+                if 0 <= tx < self._width and 0 <= ty < self._height:
+                    self._pixels[ty * self._width + tx] = value
+
+    def __eq__(self, other):
+
+        return (isinstance(other, Image) and
+                self._width == other._width and
+                self._pixels == other._pixels)
+
+    def __repr__(self):
+
+        width = self._width
+        rows = [''.join(str(value)
+                        for value in self._pixels[i:i + width])
+                for i in range(0, len(self._pixels), width)]
+        return "Image('%s:')" % ':'.join(rows)
+
+### Display
+
+class Display:
+
+    """ The 5x5 LED matrix.
+
+        Shown images are copied into the display's own pixel
+        buffer, as on the device.
+
+    """
+    _pixels = None
+    _width = 5
+    _height = 5
+
+    # Set by set_pixel() and clear(); the next sleep() then counts
+    # as frame
+    _dirty = False
+
+    # Background animation started by show(..., wait=False): iterator
+    # over the frames (None if there's no animation), the iterable
+    # for looping, the time between frames and the virtual time the
+    # next frame is due, all in us
+    _player = None
+    _player_frames = None
+    _player_loop = False
+    _player_clear = False
+    _player_delay = 0
+    _player_due = 0
+    _playing = False
+
+    def show(self, image, delay=400, wait=True, loop=False, clear=False):
+
+        emulator.charge('display.show')
+        # Showing something else stops a background animation
+        self._player = None
+        if isinstance(image, Image):
+            self._show_image(image)
+            return
+        if isinstance(image, (str, int, float)):
+            # Text is not rendered, only its display time is
+            # accounted for
+            emulator.advance(len(str(image)) * delay * 1000)
+            return
+        if not wait:
+            # Let the "firmware" play the images whenever the virtual
+            # clock advances; a delay of 0 would never let time pass
+            self._player_frames = image
+            self._player = iter(image)
+            self._player_loop = loop
+            self._player_clear = clear
+            self._player_delay = max(delay, 1) * 1000
+            self._player_due = emulator.now
+            self._play(emulator.now)
+            return
+        # Iterable of images: play them one after the other
+        while True:
+            for frame in image:
+                self._show_image(frame)
+                emulator.advance(delay * 1000)
+            if not loop:
+                break
+        if clear:
+            self.clear()
+
+    def _play(self, until):
+
+        """ Show the frames of the background animation which are due
+            until virtual time until.
+
+        """
+        if self._playing:
+            # Called via an API call made by a frame generator
+            return
+        self._playing = True
+        try:
+            shown = True
+            while self._player is not None and self._player_due <= until:
+                emulator.now = max(emulator.now, self._player_due)
+                try:
+                    frame = next(self._player)
+                except StopIteration:
+                    if self._player_loop and shown:
+                        self._player = iter(self._player_frames)
+                        shown = False
+                        continue
+                    self._player = None
+                    if self._player_clear:
+                        for i in range(25):
+                            self._pixels[i] = 0
+                    break
+                shown = True
+                self._player_due += self._player_delay
+                self._show_image(frame)
+        finally:
+            self._playing = False
+
+    def _show_image(self, image):
+
+        pixels = self._pixels
+        source = image._pixels
+        width = image._width
+        if width == 5 and image._height == 5:
+            pixels[:] = source
+        else:
+            for y in range(min(image._height, 5)):
+                for x in range(min(width, 5)):
+                    pixels[y * 5 + x] = source[y * width + x]
+        self._dirty = False
+        if emulator.show_frames:
+            emulator.frame(image)
+
+    def set_pixel(self, x, y, value):
+
+        emulator.charge('display.set_pixel')
+        if not (0 <= x < 5 and 0 <= y < 5):
+            raise ValueError('index out of bounds')
+        _check_brightness(value)
+        self._pixels[y * 5 + x] = value
+        self._dirty = True
+
+    def get_pixel(self, x, y):
+
+        emulator.charge('display.get_pixel')
+        if not (0 <= x < 5 and 0 <= y < 5):
+            raise ValueError('index out of bounds')
+        return self._pixels[y * 5 + x]
+
+    def clear(self):
+
+        emulator.charge('display.clear')
+        pixels = self._pixels
+        for i in range(25):
+            pixels[i] = 0
+        self._dirty = True
+
+    def image(self):
+
+        """ Return a copy of the LEDs as Image (emulator only).
+
+        """
+        return Image(5, 5, self._pixels)
+
+### Buttons
+
+# The MB firmware filters the button input, so that a button bouncing
+# for up to this many ms after a press doesn't count as new presses
+# (see Emulator.press())
+BUTTON_DEBOUNCE = 20
+
+class Button:
+
+    """ Button whose presses are scripted via Emulator.press().
+
+    """
+    _presses = None
+    _counted = 0
+
+    def is_pressed(self):
+
+        emulator.charge('button')
+        now = emulator.running_time()
+        for start, end in self._presses:
+            if start <= now < end:
+                return True
+        return False
+
+    def _count_presses(self):
+
+        now = emulator.running_time()
+        presses = self._presses
+        counted = self._counted
+        total = counted
+        while total < len(presses) and presses[total][0] <= now:
+            total += 1
+        self._counted = total
+        return total - counted
+
+    def get_presses(self):
+
+        """ Return the number of presses since the last call and
+            reset the count.
+
+        """
+        emulator.charge('button')
+        return self._count_presses()
+
+    def was_pressed(self):
+
+        emulator.charge('button')
+        return self._count_presses() > 0
+
+### Accelerometer
+
+class Accelerometer:
+
+    """ Accelerometer reading from Emulator.acceleration.
+
+    """
+    def get_values(self):
+
+        emulator.charge('accelerometer')
+        return tuple(emulator.acceleration(emulator.running_time()))
+
+    def get_x(self):
+        return self._get_axis(0)
+
+    def get_y(self):
+        return self._get_axis(1)
+
+    def get_z(self):
+        return self._get_axis(2)
+
+    def _get_axis(self, axis):
+
+        # A single axis is returned as small int on the device, so
+        # the tuple needed here doesn't count as allocation
+        emulator.charge('accelerometer')
+        probe = emulator.probe
+        if probe is not None:
+            probe.pause()
+        value = emulator.acceleration(emulator.running_time())[axis]
+        if probe is not None:
+            probe.resume()
+        return value
+
+### Module API
+
+display = Display()
+button_a = Button()
+button_b = Button()
+accelerometer = Accelerometer()
+emulator = Emulator()
+
+# Code in these files is not charged when tracing opcodes
+_untraced_files = {__file__}
+
+def sleep(ms):
+
+    """ Advance the virtual clock by ms milliseconds.
+
+    """
+    probe = emulator.probe
+    if probe is not None:
+        probe.pause()
+    if display._dirty:
+        display._dirty = False
+        if emulator.show_frames:
+            emulator.frame(display)
+    emulator.advance(int(ms * 1000))
+    if probe is not None:
+        probe.resume()
+
+def running_time():
+
+    emulator.charge('running_time')
+    return emulator.running_time()
+
+def panic(n=0):
+
+    raise RuntimeError('micro:bit panic %i' % n)
+
+def reset():
+
+    raise EmulatorStop('reset')
+
+### Heap
+
+# MicroPython's gc module has mem_alloc() and mem_free(), which the
+# scripts use to watch the heap. On the host, they model a heap of
+# HEAP_SIZE bytes on the memory traced by tracemalloc (0 if it isn't
+# tracing). CPython frees most garbage right away, while MicroPython
+# keeps it on the heap until it's collected, so between two calls the
+# heap grows by the peak of the traced memory over its level at the
+# last call, which includes allocations only CPython makes (e.g. for
+# ints > 256). gc.collect() shrinks it to the memory still traced since
+# the first call after Emulator.reset(), and so does the heap running
+# full, which then charges a collection like MicroPython collecting by
+# itself. These are rough figures; host/bench.py measures the
+# allocations per frame.
+HEAP_SIZE = 64 * 1024
+
+def _update_heap(collect=False):
+
+    probe = emulator.probe
+    if probe is not None:
+        probe.pause()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    if emulator.heap_base is None:
+        emulator.heap_base = emulator.heap_level = current
+    used = emulator.heap_used + max(peak - emulator.heap_level, 0)
+    emulator.heap_level = current
+    if used > HEAP_SIZE:
+        emulator.charge('gc.collect')
+        collect = True
+    if collect:
+        used = max(current - emulator.heap_base, 0)
+    emulator.heap_used = min(used, HEAP_SIZE)
+    if probe is not None:
+        probe.resume()
+
+def _mem_alloc():
+
+    emulator.charge('gc.mem_free')
+    if not tracemalloc.is_tracing():
+        return 0
+    _update_heap()
+    return emulator.heap_used
+
+def _mem_free():
+
+    return HEAP_SIZE - _mem_alloc()
+
+_gc_collect = gc.collect
+
+def _collect(generation=2):
+
+    emulator.charge('gc.collect')
+    result = _gc_collect(generation)
+    if tracemalloc.is_tracing():
+        _update_heap(collect=True)
+    return result
+
+if not hasattr(gc, 'mem_free'):
+    gc.mem_alloc = _mem_alloc
+    gc.mem_free = _mem_free
+    gc.collect = _collect
+
+### Math
+
+# MicroPython's math.sin() and math.cos() switch to slower code for
+# reducing the argument to one period at REDUCE_LIMIT, which takes
+# longer the larger the argument gets (see waves-v1.py). CPython's
+# take about the same time for any argument, so the emulator charges
+# 'math.reduce' for each doubling of the argument above the limit.
+REDUCE_LIMIT = 202
+
+def _reducing(function):
+
+    def reduced(x):
+        magnitude = abs(x)
+        if REDUCE_LIMIT <= magnitude < math.inf:
+            while magnitude >= REDUCE_LIMIT:
+                emulator.charge('math.reduce')
+                magnitude /= 2
+        return function(x)
+    reduced.__name__ = function.__name__
+    return reduced
+
+math.sin = _reducing(math.sin)
+math.cos = _reducing(math.cos)
+
+###
+
+def render(image):
+
+    """ Return an ASCII rendering of image.
+
+    """
+    shades = ' .:-=+*#%@'
+    width = image._width
+    pixels = image._pixels
+    return '\n'.join(
+        '|%s|' % ''.join(shades[value] * 2
+                         for value in pixels[i:i + width])
+        for i in range(0, len(pixels), width))
+
+def main():
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run a micro:bit script on the host.')
+    parser.add_argument('script')
+    parser.add_argument('--frames', type=int, default=100,
+                        help='stop after this many frames')
+    parser.add_argument('--ms', type=int,
+                        help='stop after this much virtual time')
+    parser.add_argument('--show', action='store_true',
+                        help='print each frame')
+    parser.add_argument('--trace', action='store_true',
+                        help='charge the opcode cost per bytecode')
+    parser.add_argument('--press', default='', metavar='SCRIPT',
+                        help='button presses, e.g. "a@1000 ab@2500+800" '
+                             'presses A at 1000 ms and both buttons at '
+                             '2500 ms for 800 ms')
+    parser.add_argument('--replay', metavar='TRACE',
+                        help='replay an accelerometer trace recorded '
+                             'with record.py')
+    options = parser.parse_args()
+
+    # Make sure the script imports this module, not a second copy
+    sys.modules['microbit'] = sys.modules[__name__]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(options.script)))
+    if options.show:
+        emulator.frame_hooks.append(
+            lambda image: print(render(image) + '\n'))
+    if options.trace:
+        emulator.trace_opcodes()
+    emulator.press_script(options.press)
+    if options.replay:
+        emulator.load_trace(options.replay)
+    try:
+        emulator.run_script(options.script, options.frames, options.ms)
+    finally:
+        emulator.trace_opcodes(False)
+    print('%i frames in %i ms virtual time (%.1f fps), %i opcodes' % (
+        emulator.frames, emulator.running_time(),
+        emulator.frames / max(emulator.now, 1) * 1e6,
+        emulator.opcodes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+""" Host-side stand-in for the MicroPython uasyncio module.
+
+    Only the parts the scripts use are provided: run(), create_task(),
+    sleep() and sleep_ms() and cancelling tasks. The tasks are run
+    on the emulator's virtual clock (see microbit.py): when all tasks
+    are sleeping, the event loop sleeps with microbit.sleep() until
+    the next one is due, so the frames and timings are deterministic,
+    as for the blocking scripts.
+
+    Tasks which are due at the same time run in the order they were
+    created or woke up.
+
+"""
+import microbit
+from microbit import emulator
+
+class CancelledError(BaseException):
+
+    pass
+
+class _Sleep:
+
+    """ Awaitable returned by sleep_ms().
+
+        There is only one, like on the device, so that sleeping
+        doesn't allocate. Awaiting it yields .ms to the event loop
+        once; the task continues when it's resumed.
+
+    """
+    ms = 0
+    pending = False
+
+    def __await__(self):
+
+        self.pending = True
+        return self
+
+    __iter__ = __await__
+
+    def __next__(self):
+
+        if self.pending:
+            self.pending = False
+            return self.ms
+        # The traceback attached by raising is freed again within
+        # the task's await, so it doesn't count as allocation
+        raise _resumed.with_traceback(None)
+
+_resumed = StopIteration()
+
+_sleep = _Sleep()
+
+def sleep_ms(ms):
+
+    _sleep.ms = ms
+    return _sleep
+
+def sleep(seconds):
+
+    return sleep_ms(seconds * 1000)
+
+class Task:
+
+    # Virtual time in us the task is due to run again
+    due = 0
+
+    # Set when the coroutine has returned or was cancelled
+    done = False
+
+    # Exception thrown into the coroutine when it runs next
+    cancelled = False
+
+    def __init__(self, coro, seq):
+
+        self.coro = coro
+        self.seq = seq
+        self.due = emulator.now
+
+    def cancel(self):
+
+        self.cancelled = True
+        self.due = emulator.now
+
+# Tasks which have not finished yet
+_tasks = []
+_seq = 0
+
+def create_task(coro):
+
+    global _seq
+    _seq += 1
+    task = Task(coro, _seq)
+    _tasks.append(task)
+    return task
+
+def _run_once():
+
+    """ Run the task which is due next until it sleeps again.
+
+    """
+    global _seq
+    # The scheduling is done by the firmware on the device, so keep
+    # it out of the allocation figures
+    probe = emulator.probe
+    if probe is not None:
+        probe.pause()
+    task = None
+    for candidate in _tasks:
+        if (task is None or candidate.due < task.due or
+            (candidate.due == task.due and candidate.seq < task.seq)):
+            task = candidate
+    if task.due > emulator.now:
+        microbit.sleep((task.due - emulator.now) / 1000.0)
+    if probe is not None:
+        probe.resume()
+    try:
+        if task.cancelled:
+            ms = task.coro.throw(CancelledError())
+        else:
+            ms = task.coro.send(None)
+    except (StopIteration, CancelledError):
+        task.done = True
+        _tasks.remove(task)
+        return
+    finally:
+        if probe is not None:
+            probe.pause()
+    _seq += 1
+    task.seq = _seq
+    task.due = emulator.now + int(ms * 1000)
+    if probe is not None:
+        probe.resume()
+
+def run(coro):
+
+    """ Run coro and the tasks it creates until coro returns.
+
+    """
+    main = create_task(coro)
+    try:
+        while not main.done:
+            _run_once()
+    finally:
+        for task in _tasks:
+            task.coro.close()
+        del _tasks[:]
+
+# Like the microbit module, this one is part of the "firmware"
+microbit._untraced_files.add(__file__)
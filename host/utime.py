@@ -0,0 +1,59 @@
+""" Host-side stand-in for the MicroPython utime module.
+
+    The ticks are read from the emulator's virtual clock (see
+    microbit.py), so timings taken with ticks_us() are deterministic
+    and include the opcode costs when tracing. As on the device, the
+    ticks wrap around and have to be compared with ticks_diff().
+
+"""
+import microbit
+from microbit import emulator
+
+# The ticks wrap around at TICKS_PERIOD, like on the device
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD // 2
+
+def ticks_us():
+
+    emulator.charge('ticks')
+    return emulator.now & _TICKS_MAX
+
+def ticks_ms():
+
+    emulator.charge('ticks')
+    return (emulator.now // 1000) & _TICKS_MAX
+
+def ticks_add(ticks, delta):
+
+    return (ticks + delta) & _TICKS_MAX
+
+def ticks_diff(ticks1, ticks2):
+
+    """ Return ticks1 - ticks2, taking the wrap around into account.
+
+    """
+    # The intermediate results are small ints on the device, so
+    # keep them out of the allocation figures
+    probe = emulator.probe
+    if probe is not None:
+        probe.pause()
+    diff = ((ticks1 - ticks2 + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+    if probe is not None:
+        probe.resume()
+    return diff
+
+def sleep_ms(ms):
+
+    microbit.sleep(ms)
+
+def sleep_us(us):
+
+    microbit.sleep(us / 1000.0)
+
+def sleep(seconds):
+
+    microbit.sleep(seconds * 1000)
+
+# Like the microbit module, this one is part of the "firmware"
+microbit._untraced_files.add(__file__)
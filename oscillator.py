@@ -0,0 +1,91 @@
+""" Sine oscillator using an integer sine table.
+
+    math.sin() gets slow for large arguments, since it has to reduce
+    them to one period first (see waves-v1.py), and each call creates
+    a new float object. The oscillator instead looks up the samples in
+    a table with one entry per degree, indexed by an integer phase
+    which always stays within one period. Each sample then costs the
+    same, no matter how long an animation has been running, and only
+    uses small ints.
+
+    The table has 360 entries, so that the usual periods (4, 5, 6, 8,
+    9, 10, 12 ... samples) hit the table entries exactly.
+
+"""
+import array
+import math
+
+# Number of fractional bits of the samples and the integer
+# representing 1.0
+SHIFT = 12
+ONE = 1 << SHIFT
+
+# Number of table entries per period, i.e. degrees
+PHASES = 360
+
+# sin() of the degrees 0-359, scaled by ONE
+SINE = array.array('h', (int(round(math.sin(math.pi * i / 180) * ONE))
+                         for i in range(PHASES)))
+
+###
+
+def sine(degrees):
+
+    """ Return sin() of the integer degrees, scaled by ONE.
+
+    """
+    return SINE[degrees % PHASES]
+
+### Oscillator class
+
+class Oscillator:
+
+    """ Sine oscillator with a period of period samples.
+
+        The samples are scaled to +/- amplitude, rounded down.
+
+    """
+    # Phase of the current sample, counted in 1/period degrees, so
+    # that stepping by one sample (PHASES units) never drifts, even if
+    # period does not divide 360; always kept below limit
+    phase = 0
+
+    def __init__(self, period, amplitude=ONE, phase=0):
+
+        self.period = period
+        self.amplitude = amplitude
+        self.limit = PHASES * period
+        # Phase of the first sample in degrees
+        self.start = (phase * period) % self.limit
+        self.phase = self.start
+
+    def reset(self):
+
+        """ Go back to the first sample.
+
+        """
+        self.phase = self.start
+
+    def sample(self, samples=0):
+
+        """ Return the sample the given number of samples after the
+            current one, without advancing.
+
+            samples may be any int; the cost doesn't depend on it.
+
+        """
+        phase = (self.phase + samples * PHASES) % self.limit
+        return (SINE[phase // self.period] * self.amplitude) >> SHIFT
+
+    def next(self):
+
+        """ Return the current sample and advance to the next one.
+
+        """
+        phase = self.phase
+        value = (SINE[phase // self.period] * self.amplitude) >> SHIFT
+        phase += PHASES
+        if phase >= self.limit:
+            phase -= self.limit
+        self.phase = phase
+        return value
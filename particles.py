@@ -0,0 +1,212 @@
+""" Particle system for scenes with many moving points.
+
+    The particles are kept in parallel arrays of fixed point integers
+    (see fixeddisplay.py) instead of one object per particle, so
+    neither moving them nor drawing them needs any heap memory. step()
+    advances all particles at once and draw() splats them into a
+    single FixedDisplay, visiting only the LEDs within the radius of
+    the point kernel (see FixedDisplay.add_point()).
+
+    Particles are removed when they have faded out or, unless bounce
+    is set, when they have left the display.
+
+"""
+import array
+import math
+from fixeddisplay import FixedDisplay, ONE, SHIFT, SCALE_SHIFT
+
+# Particles below this level are removed (about one MB LED level)
+MIN_LEVEL = ONE // 9
+
+# Particles further outside the display than this are removed,
+# unless they bounce
+MARGIN = ONE
+
+### Particle system class
+
+class Particles:
+
+    # Number of live particles, stored at index 0 to count - 1 of
+    # the arrays
+    count = 0
+
+    # Highest level emitted and the distance (scaled by ONE) at which
+    # its kernel has faded to 0
+    max_level = 0
+    radius = 0
+
+    # If set, particles bounce off the display edges instead of
+    # leaving the display
+    bounce = False
+
+    def __init__(self, capacity, scale=2.0, bounce=False):
+
+        self.capacity = capacity
+        # Scale of the point kernel, see FixedDisplay.add_point()
+        self.scale = int(scale * (1 << SCALE_SHIFT))
+        self.bounce = bounce
+        # Position and speed per step, level and decay factor per
+        # step of each particle, all scaled by ONE
+        self.row = array.array('i', [0] * capacity)
+        self.column = array.array('i', [0] * capacity)
+        self.row_speed = array.array('i', [0] * capacity)
+        self.column_speed = array.array('i', [0] * capacity)
+        self.level = array.array('i', [0] * capacity)
+        self.decay = array.array('i', [0] * capacity)
+        # Display the particles are drawn onto
+        self.frame = FixedDisplay()
+
+    def emit(self, row, column, row_speed=0.0, column_speed=0.0,
+             level=1.0, decay=1.0):
+
+        """ Add a particle at floating point row and column, moving by
+            row_speed and column_speed and fading by decay per step.
+
+            Returns False if there is no room for the particle.
+
+        """
+        i = self.count
+        if i >= self.capacity:
+            return False
+        self.row[i] = int(row * ONE)
+        self.column[i] = int(column * ONE)
+        self.row_speed[i] = int(row_speed * ONE)
+        self.column_speed[i] = int(column_speed * ONE)
+        level = self.level[i] = int(level * ONE)
+        self.decay[i] = int(decay * ONE)
+        self.count = i + 1
+        if level > self.max_level:
+            # Particles fade, so the brightest one emitted so far
+            # determines the largest kernel
+            self.max_level = level
+            self.radius = int(
+                math.sqrt(level * (1 << SCALE_SHIFT) / self.scale / ONE)
+                * ONE) + 1
+        return True
+
+    def remove(self, i):
+
+        """ Remove particle i.
+
+            The last particle takes its place, so the arrays stay
+            compact.
+
+        """
+        last = self.count - 1
+        if i != last:
+            self.row[i] = self.row[last]
+            self.column[i] = self.column[last]
+            self.row_speed[i] = self.row_speed[last]
+            self.column_speed[i] = self.column_speed[last]
+            self.level[i] = self.level[last]
+            self.decay[i] = self.decay[last]
+        self.count = last
+
+    def clear(self):
+
+        """ Remove all particles.
+
+        """
+        self.count = 0
+
+    def step(self):
+
+        """ Move and fade all particles by one step.
+
+        """
+        rows = self.row
+        columns = self.column
+        row_speeds = self.row_speed
+        column_speeds = self.column_speed
+        levels = self.level
+        decays = self.decay
+        bounce = self.bounce
+        edge = 4 * ONE
+        i = self.count - 1
+        # Walk backwards, so that removing a particle only moves an
+        # already updated one into its place
+        while i >= 0:
+            level = (levels[i] * decays[i]) >> SHIFT
+            levels[i] = level
+            row = rows[i] + row_speeds[i]
+            column = columns[i] + column_speeds[i]
+            if bounce:
+                if row < 0 or row > edge:
+                    row_speeds[i] = -row_speeds[i]
+                    row = -row if row < 0 else 2 * edge - row
+                if column < 0 or column > edge:
+                    column_speeds[i] = -column_speeds[i]
+                    column = -column if column < 0 else 2 * edge - column
+            elif (row < -MARGIN or row > edge + MARGIN or
+                  column < -MARGIN or column > edge + MARGIN):
+                level = 0
+            rows[i] = row
+            columns[i] = column
+            if level < MIN_LEVEL:
+                self.remove(i)
+            i -= 1
+
+    def draw(self):
+
+        """ Draw all particles onto the display.
+
+            Overlapping particles add up.
+
+        """
+        frame = self.frame
+        frame.clear()
+        leds = frame.leds
+        rows = self.row
+        columns = self.column
+        levels = self.level
+        scale = self.scale
+        radius = self.radius
+        for i in range(self.count):
+            row = rows[i]
+            column = columns[i]
+            level = levels[i]
+            # Only visit the LEDs within the radius of the kernel
+            first_row = (row - radius + ONE - 1) >> SHIFT
+            if first_row < 0:
+                first_row = 0
+            last_row = ((row + radius) >> SHIFT) + 1
+            if last_row > 5:
+                last_row = 5
+            first_column = (column - radius + ONE - 1) >> SHIFT
+            if first_column < 0:
+                first_column = 0
+            last_column = ((column + radius) >> SHIFT) + 1
+            if last_column > 5:
+                last_column = 5
+            limit = level << SCALE_SHIFT
+            for led_row in range(first_row, last_row):
+                d = row - (led_row << SHIFT)
+                row_term = scale * ((d * d) >> SHIFT)
+                if row_term >= limit:
+                    continue
+                leds_row = leds[led_row]
+                for led_column in range(first_column, last_column):
+                    d = column - (led_column << SHIFT)
+                    x = level - ((row_term + scale * ((d * d) >> SHIFT))
+                                 >> SCALE_SHIFT)
+                    if x > 0:
+                        leds_row[led_column] += x
+
+    def render(self):
+
+        """ Draw all particles and return them as MB image.
+
+        """
+        self.draw()
+        return self.frame.render()
+
+    def display(self, force=False):
+
+        """ Draw all particles and display them.
+
+            As with FixedDisplay.display(), the frame is only shown
+            if it changed; see .frame.blits and .frame.skips.
+
+        """
+        self.draw()
+        self.frame.display(force)
@@ -10,7 +10,12 @@
 
 """
 import microbit
-import math
+import brightness
+from oscillator import sine, ONE
+from brightness import STEPS, OUTSIDE, LAST
+from scheduler import FrameScheduler
+from buttons import Buttons
+from stages import COMPUTE, QUANTIZE, BLIT, SLEEP
 
 ### Float display class
 
@@ -19,40 +24,157 @@ class FloatDisplay:
     # Array of floating point LED brightness levels (0.0=off, 1.0=on);
     # rows and columns correspond to the LEDs on the Microbit, e.g. 
     # leds[0][2] maps to the second LED in the first row.
+    #
+    # This is the back buffer all drawing goes to.
     leds = None
 
+    # Front buffer: MB image which .display() fills in place and
+    # hands to the MB display. The display copies the image, so it
+    # can be reused for the next frame right away.
+    image = None
+
+    # Column origin: the rows are used as ring buffers, with
+    # column 0 stored at index origin. Scrolling only moves the
+    # origin instead of rebuilding the rows.
+    origin = 0
+
+    # Row indexes of the columns per origin, i.e.
+    # rotations[origin][column] == (origin + column) % 5
+    rotations = tuple(tuple((origin + column) % 5 for column in range(5))
+                      for origin in range(5))
+
+    # Cache of sine_point() brightness levels per arguments and the
+    # maximum number of entries it holds
+    sine_frames = None
+    sine_cache_size = 32
+
+    # Work lists for add_point()
+    row_levels = None
+    column_terms = None
+
+    # Quantization table mapping int(level * STEPS) to MB LED levels;
+    # shared by all displays, use brightness.table(gamma) for a
+    # gamma curve
+    levels = brightness.LINEAR
+
+    # Copy of the rows, the origin and the table last written to
+    # .image; only the rows which changed since are written again.
+    # While the display scrolls, the rows aren't copied and stale
+    # is set.
+    shown = None
+    shown_origin = None
+    shown_levels = None
+    stale = True
+
+    # Set when .image differs from what .display() last showed
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
     def __init__(self):
 
-        self.clear()
+        self.leds = [[0.0]*5 for i in range(5)]
+        self.shown = [[0.0]*5 for i in range(5)]
+        self.image = microbit.Image(5, 5)
+        self.row_levels = [0.0] * 5
+        self.column_terms = [0.0] * 5
+        self.sine_frames = {}
     
     def clear(self):
         
         """ Clear the SmartDisplay.
+
+            The rows are cleared in place, so no memory gets
+            allocated.
         
         """
-        self.leds = [[0.0]*5 for i in range(5)]
+        for row in self.leds:
+            for column in range(5):
+                row[column] = 0.0
+        self.origin = 0
 
-    def display(self):
+    def render(self):
         
         """ Write the contents of the SmartDisplay to the
-            MB image buffer and display it.
+            MB image buffer and return it.
+
+            The brightness levels are mapped to MB LED levels
+            using the quantization table .levels, which also clips
+            them to the permitted range.
 
-            The method applies clipping to keep the brightness
-            values within the permitted range.
+            The front buffer image is reused, so no memory gets
+            allocated for it. Rows which didn't change since the
+            last call are not written again.
 
         """
-        img_array = bytearray()
+        leds = self.leds
+        shown = self.shown
+        image = self.image
+        origin = self.origin
+        columns = self.rotations[origin]
+        levels = self.levels
         local_int = int
-        for row in self.leds:
-            for x in row:
-                x = local_int(x * 9.0)
-                if x < 0:
-                    x = 0
-                elif x > 9:
-                    x = 9
-                img_array.append(x)
-        img = microbit.Image(5, 5, img_array)
-        microbit.display.show(img)
+        redraw = copy = True
+        if origin != self.shown_origin or levels is not self.shown_levels:
+            # Scrolling or a new table changes all pixels; the rows
+            # are only compared again once the display stays put
+            self.shown_origin = origin
+            self.shown_levels = levels
+            self.stale = True
+            copy = False
+        elif self.stale:
+            self.stale = False
+        else:
+            redraw = False
+        changed = redraw
+        for row in range(5):
+            leds_row = leds[row]
+            if not redraw:
+                if leds_row == shown[row]:
+                    continue
+                changed = True
+            if copy:
+                shown[row][:] = leds_row
+            for column in range(5):
+                i = local_int(leds_row[columns[column]] * STEPS)
+                if i & OUTSIDE:
+                    # Clip levels outside of the table
+                    i = 0 if i < 0 else LAST
+                image.set_pixel(column, row, levels[i])
+        if changed:
+            self.changed = True
+        return image
+
+    def display(self, force=False):
+
+        """ Write the contents of the SmartDisplay to the
+            MB image buffer and display it.
+
+            The frame is only shown if it changed since the last
+            call, see .blit().
+
+        """
+        self.render()
+        self.blit(force)
+
+    def blit(self, force=False):
+
+        """ Hand the image written by the last .render() to the MB
+            display, unless it's shown already.
+
+            .blits and .skips count the frames shown and skipped.
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if self.changed or force:
+            microbit.display.show(self.image)
+            self.changed = False
+            self.blits += 1
+        else:
+            self.skips += 1
 
     def set_dot(self, row, column, level=1.0):
 
@@ -61,7 +183,7 @@ class FloatDisplay:
             Does not clear the other content.
 
         """
-        self.leds[row][column] = level
+        self.leds[row][self.rotations[self.origin][column]] = level
 
     def show_point(self, row, column, level=1.0, scale=5.0):
       
@@ -69,38 +191,104 @@ class FloatDisplay:
             interpolates the brightness.
             
             All other display content is cleared.
+
+            LEDs the point does not reach are set to 0.0.
             
         """
+        self.clear()
+        self.add_point(row, column, level, scale)
+
+    def add_point(self, row, column, level=1.0, scale=5.0):
+
+        """ Add a point at floating point row and column to the
+            display content, interpolating the brightness.
+
+            Only the LEDs the point reaches are visited, so the
+            cost depends on the size of the point, not the display.
+
+        """
+        # The squared distance splits into a row and a column term,
+        # which are computed once per row and column. The LEDs with
+        # level - scale * d2 > 0 then lie within the ranges of rows
+        # and columns where the terms alone stay below level.
+        row_levels = self.row_levels
+        column_terms = self.column_terms
+        first_row = first_column = 5
+        last_row = last_column = 0
+        for i in range(5):
+            d = row - i
+            x = level - scale * d * d
+            row_levels[i] = x
+            if x > 0.0:
+                if i < first_row:
+                    first_row = i
+                last_row = i + 1
+            d = column - i
+            x = scale * d * d
+            column_terms[i] = x
+            if x < level:
+                if i < first_column:
+                    first_column = i
+                last_column = i + 1
         leds = self.leds
-        for led_row in range(5):
-            for led_column in range(5):
-                # Calculate the squared distance
-                d2 = (row - led_row)**2.0 + (column - led_column)**2.0
-                # Set brightness based on the distance to the point,
-                # using scale for scaling
-                leds[led_row][led_column] = level - scale * d2
+        columns = self.rotations[self.origin]
+        for led_row in range(first_row, last_row):
+            leds_row = leds[led_row]
+            row_level = row_levels[led_row]
+            for led_column in range(first_column, last_column):
+                x = row_level - column_terms[led_column]
+                if x > 0.0:
+                    leds_row[columns[led_column]] += x
 
     def sine_point(self, row, column, level=1.0, offset=0.0):
         
+        """ Show a sine shaped hill centered at floating point row
+            and column.
+
+            All other display content is replaced. The brightness
+            levels are cached per arguments, so showing the same
+            point again only copies them.
+
+        """
+        key = (row, column, level, offset)
+        sine_frames = self.sine_frames
+        frame = sine_frames.get(key)
+        if frame is None:
+            if len(sine_frames) >= self.sine_cache_size:
+                # Start over instead of tracking the use of entries
+                sine_frames.clear()
+            frame = sine_frames[key] = self.sine_frame(row, column, level)
         leds = self.leds
-        sin = math.sin
-        d_factor = math.pi / 5.0
-        d_offset = math.pi / 2
-        if level < 0:
-            offset = 1.0 - offset
-        y_factor = level / 2
+        self.origin = 0
+        for led_row in range(5):
+            leds_row = leds[led_row]
+            frame_row = frame[led_row]
+            for led_column in range(5):
+                leds_row[led_column] = frame_row[led_column]
+
+    def sine_frame(self, row, column, level=1.0):
+
+        """ Return the brightness levels of sine_point() as tuple of
+            five rows.
+
+        """
+        # The sines are scaled by ONE
+        y_factor = level / (2 * ONE)
         if level < 0:
             offset = 1.0
         else:
             offset = 0.0
-        for led_row in range(5):
-            for led_column in range(5):
-                # Calculate the squared distance
-                y = (sin((row - led_row) * d_factor + d_offset) + 
-                     sin((column - led_column) * d_factor + d_offset))
-                # Set brightness based on the distance to the point,
-                # using scale for scaling
-                leds[led_row][led_column] = y_factor * y + offset
+        # The sum of sines is separable, so only 5 row and 5 column
+        # terms are needed instead of two sines per LED; the sines
+        # have a period of 10 LEDs (36 degrees per LED) and start at
+        # 90 degrees
+        row_terms = [sine(round((row - led_row) * 36 + 90))
+                     for led_row in range(5)]
+        column_terms = [sine(round((column - led_column) * 36 + 90))
+                        for led_column in range(5)]
+        return tuple(tuple(y_factor * (y + x) + offset
+                           for x in column_terms)
+                     for y in row_terms)
 
     def add(self, sd, offset_row=0, offset_column=0):
         
@@ -111,79 +299,116 @@ class FloatDisplay:
 
         """
         leds = self.leds
-        for row in range(5):
-            # Make sure we keep within the display bounds
-            if offset_row:
-                other_row_index = row + offset_row
-                if (other_row_index > 4 or 
-                    other_row_index < 0):
-                    continue
-            else:
-                other_row_index = row
+        our_columns = self.rotations[self.origin]
+        other_columns = self.rotations[sd.origin]
+        # Clip the overlapping area once, instead of per LED
+        first_row = max(0, -offset_row)
+        last_row = min(5, 5 - offset_row)
+        first_column = max(0, -offset_column)
+        last_column = min(5, 5 - offset_column)
+        for row in range(first_row, last_row):
             our_row = leds[row]
-            other_row = sd.leds[other_row_index]
-            for column in range(5):
-                # Make sure we keep within the display bounds
-                if offset_column:
-                    other_column = column + offset_column
-                    if (other_column > 4 or 
-                        other_column < 0):
-                        continue
-                else:
-                    other_column = column
-                our_row[column] = (
-                    our_row[column] + other_row[other_column])
+            other_row = sd.leds[row + offset_row]
+            for column in range(first_column, last_column):
+                our_column = our_columns[column]
+                our_row[our_column] = (
+                    our_row[our_column] +
+                    other_row[other_columns[column + offset_column]])
 
     def dim(self, factor=0.5):
         
         """ Dim the SmartDisplay content by factor.
         
         """
-        leds = self.leds
-        for row in range(5):
-            row = leds[row]
-            for column, x in enumerate(row):
-                row[column] *= x * factor
+        for row in self.leds:
+            for column in range(5):
+                row[column] *= factor
 
     def scroll_left(self, columns=1, fill_value=0.0):
     
         """ Scroll the display to the left by the given number
             of columns (default is one).
+
+            Only the origin is moved and the columns scrolled in
+            are filled, so no memory gets allocated.
         
         """
-        leds = self.leds
-        columns = min(columns, 5)
-        filler = [fill_value] * columns
-        for row in range(5):
-            leds[row] = leds[row][columns:] + filler
+        origin = self.origin
+        if columns > 5:
+            columns = 5
+        for row in self.leds:
+            # The columns scrolled out become the right-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = (origin + columns) % 5
 
     def scroll_right(self, columns=1, fill_value=0.0):
     
         """ Scroll the display to the right by the given number
             of columns (default is one).
+
+            Only the origin is moved and the columns scrolled in
+            are filled, so no memory gets allocated.
         
         """
-        leds = self.leds
-        columns = min(columns, 5)
-        filler = [fill_value] * columns
-        for row in range(5):
-            leds[row] = filler + leds[row][:-columns]
+        if columns > 5:
+            columns = 5
+        origin = (self.origin - columns) % 5
+        for row in self.leds:
+            # The columns scrolled out become the left-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = fill_value
+        self.origin = origin
 
 ###
 
-def sines(delay, segments=9):
+def sines(delay, segments=9, profiler=None):
     
     fd = FloatDisplay()
+    # Show a frame every delay ms, no matter how long it takes to
+    # render it
+    scheduler = FrameScheduler(delay)
+    buttons = Buttons()
+    if profiler:
+        profiler.start(buttons)
     for i in range(1000):
         for x in range(0, 10):
             level = x / 10
-            fd.clear()
             fd.sine_point(2, 2, level=level, offset=0.1)
-            fd.display()
-            microbit.sleep(delay)
-            if microbit.button_a.is_pressed():
-                delay = max(0, delay - 10)
-            if microbit.button_b.is_pressed():
-                delay += 10
-
-sines(300)
+            if profiler:
+                profiler.mark(COMPUTE)
+            fd.render()
+            if profiler:
+                profiler.mark(QUANTIZE)
+            fd.blit()
+            if profiler:
+                profiler.mark(BLIT)
+            scheduler.wait()
+            if profiler:
+                profiler.mark(SLEEP)
+            if buttons.poll():
+                scheduler.period = buttons.adjust(scheduler.period, 10)
+            if profiler:
+                profiler.mark(COMPUTE)
+                profiler.next()
+
+def sines_effect(delay):
+
+    """ Generator version of sines() for the Runner (see runner.py).
+
+    """
+    fd = FloatDisplay()
+    buttons = Buttons()
+    resumed = yield 0
+    while True:
+        for x in range(0, 10):
+            level = x / 10
+            fd.sine_point(2, 2, level=level, offset=0.1)
+            # Another effect may have been shown in between
+            fd.display(resumed)
+            resumed = yield delay
+            if buttons.poll():
+                delay = buttons.adjust(delay, 10)
+
+if __name__ == '__main__':
+    sines(300)
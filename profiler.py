@@ -0,0 +1,248 @@
+""" Per-stage frame timings kept in a fixed size ring buffer.
+
+    Printing or collecting timings in an effect loop allocates memory
+    on every frame, which eventually ends in a MemoryError on the
+    device (see waves-v1.py). A Profiler instead preallocates an
+    array with room for the stage timings of the last size frames and
+    overwrites the oldest frame once it's full, so recording a timing
+    only stores a small int. The statistics are computed when asked
+    for with .stats() or .dump(), e.g. on a long button press.
+
+    An effect calls .start() right before its loop, so that setting
+    up the effect isn't counted, passing the Buttons (see buttons.py)
+    it reads its buttons through, so that a long press of the
+    profiler's button dumps the statistics. The loop then calls
+    .mark(stage) at the end of each stage of a frame, which records
+    the time since the previous mark, and .next() at the end of the
+    frame. Stages an effect doesn't have are simply not marked and
+    read as 0.
+
+    A HeapProfiler additionally records the bytes allocated per frame
+    and the garbage collection pauses, using gc.mem_free().
+
+"""
+import array
+import gc
+import utime
+from stages import STAGES
+
+# Columns added by HeapProfiler
+ALLOC = 4       # bytes allocated during the frame
+GC = 5          # garbage collection after the frame in us
+
+HEAP_STAGES = STAGES + ('alloc', 'gc')
+
+### Profiler class
+
+class Profiler:
+
+    # Number of frames kept in the ring buffer
+    size = 0
+
+    # Number of frames recorded since the start
+    frames = 0
+
+    # Index of the current frame's first timing in .times
+    base = 0
+
+    # Ticks of the last mark in us
+    last = 0
+
+    # Button ('a' or 'b') whose long press makes .next() dump the
+    # statistics (the long press also repeats the button's steps);
+    # None disables this
+    button = None
+
+    # The Button of the effect's Buttons read for .button, and whether
+    # it was held down long at the last frame
+    watched = None
+    long_held = False
+
+    # Units of the stages printed by .dump(), if not us
+    units = {}
+
+    def __init__(self, size=64, stages=STAGES, button=None):
+
+        self.size = size
+        self.stages = stages
+        self.button = button
+        # Timings in us, len(stages) per frame, in the order of the
+        # frames
+        self.times = array.array('i', [0] * (size * len(stages)))
+        self.last = utime.ticks_us()
+
+    def mark(self, stage):
+
+        """ End stage of the current frame.
+
+            The time since the last mark is added to the stage.
+
+        """
+        now = utime.ticks_us()
+        self.times[self.base + stage] += utime.ticks_diff(now, self.last)
+        self.last = now
+
+    def start(self, buttons=None):
+
+        """ Start timing the first frame.
+
+            buttons is the Buttons instance the effect polls, if
+            any; .button is read from it, since a Buttons instance
+            reads the button presses itself (with get_presses()), so
+            the profiler can't check the button on its own.
+
+        """
+        if buttons is not None and self.button is not None:
+            self.watched = getattr(buttons, self.button)
+        self.last = utime.ticks_us()
+
+    def next(self):
+
+        """ End the current frame and start the next one.
+
+        """
+        self.frames += 1
+        times = self.times
+        count = len(self.stages)
+        base = self.base + count
+        if base == len(times):
+            base = 0
+        self.base = base
+        for stage in range(count):
+            times[base + stage] = 0
+        watched = self.watched
+        if watched is not None:
+            long_held = watched.long_held
+            if long_held and not self.long_held:
+                self.dump()
+            self.long_held = long_held
+
+    def stats(self, stage):
+
+        """ Return (min, mean, max, 50th, 90th and 99th percentile) of
+            the values of stage (timings in us) over the frames in the
+            ring buffer, or None if there are none yet.
+
+        """
+        times = self.times
+        count = len(self.stages)
+        frames = min(self.frames, self.size - 1)
+        if not frames:
+            return None
+        values = []
+        base = self.base
+        for frame in range(frames):
+            base -= count
+            if base < 0:
+                base += len(times)
+            values.append(times[base + stage])
+        values.sort()
+        return (values[0],
+                sum(values) / frames,
+                values[-1],
+                values[frames * 50 // 100],
+                values[frames * 90 // 100],
+                values[frames * 99 // 100])
+
+    def dump(self):
+
+        """ Print the statistics of all stages.
+
+        """
+        print('%i frames, last %i:' % (
+            self.frames, min(self.frames, self.size - 1)))
+        for stage, name in enumerate(self.stages):
+            stats = self.stats(stage)
+            if stats is None:
+                continue
+            print('%-8s min %6i mean %8.1f max %6i '
+                  'p50 %6i p90 %6i p99 %6i %s' % (
+                      (name,) + stats + (self.units.get(name, 'us'),)))
+
+### Heap profiler class
+
+class HeapProfiler(Profiler):
+
+    """ Profiler which also records the bytes allocated per frame
+        and the time spent collecting garbage.
+
+        Automatic garbage collection is disabled, so that the free
+        memory only goes down while the effect runs and the
+        difference between two frames is what the frame allocated.
+        Once less than reserve bytes are free, .next() collects the
+        garbage itself and records how long that took. A frame
+        allocating more than that still makes MicroPython collect
+        automatically; these collections are only counted.
+
+        Call .stop() once done profiling to enable automatic garbage
+        collection again.
+
+    """
+    units = {'alloc': 'bytes'}
+
+    # Free memory after the last frame in bytes
+    free = 0
+
+    # Number of collections run by .next() and by MicroPython
+    collections = 0
+    auto_collections = 0
+
+    def __init__(self, size=64, button=None, reserve=2048):
+
+        Profiler.__init__(self, size, HEAP_STAGES, button)
+        self.reserve = reserve
+        gc.collect()
+        gc.disable()
+        self.free = gc.mem_free()
+
+    def start(self, buttons=None):
+
+        """ Start timing the first frame and counting its
+            allocations.
+
+        """
+        # Don't count the garbage of the setup in the first frame
+        gc.collect()
+        self.free = gc.mem_free()
+        Profiler.start(self, buttons)
+
+    def next(self):
+
+        """ End the current frame, collect the garbage if the free
+            memory is running low and start the next frame.
+
+        """
+        times = self.times
+        base = self.base
+        free = gc.mem_free()
+        allocated = self.free - free
+        if allocated < 0:
+            # The heap ran full and MicroPython collected by itself
+            self.auto_collections += 1
+            allocated = 0
+        times[base + ALLOC] = allocated
+        if free < self.reserve:
+            start = utime.ticks_us()
+            gc.collect()
+            now = utime.ticks_us()
+            times[base + GC] = utime.ticks_diff(now, start)
+            self.collections += 1
+            # Don't count the collection in the next frame
+            self.last = now
+        Profiler.next(self)
+        # Taken last, so that a dump isn't counted either
+        self.free = gc.mem_free()
+
+    def stop(self):
+
+        """ Stop profiling and enable automatic garbage collection
+            again.
+
+        """
+        gc.enable()
+
+    def dump(self):
+
+        Profiler.dump(self)
+        print('%i collections, %i automatic, %i bytes free' % (
+            self.collections, self.auto_collections, self.free))
@@ -0,0 +1,37 @@
+""" Record an accelerometer trace over the serial console.
+
+    Prints one "ms,x,y,z" line per reading, every period ms, while the
+    board is moved around. Capture the console output in a file (e.g.
+    with "screen -L" or miniterm) and replay it on the host with
+
+        python host/microbit.py --replay trace.csv balance.py
+
+    Recording starts when button A is pressed and stops after
+    duration ms or when button A is pressed again; the center LED is
+    lit while recording.
+
+"""
+import microbit
+
+def record(period=5, duration=20000):
+    accelerometer = microbit.accelerometer
+    while not microbit.button_a.was_pressed():
+        microbit.sleep(10)
+    microbit.display.set_pixel(2, 2, 9)
+    start = microbit.running_time()
+    end = start + duration
+    due = start
+    while True:
+        now = microbit.running_time()
+        if now >= end or microbit.button_a.was_pressed():
+            break
+        x, y, z = accelerometer.get_values()
+        print('%i,%i,%i,%i' % (now, x, y, z))
+        due += period
+        delay = due - microbit.running_time()
+        if delay > 0:
+            microbit.sleep(delay)
+    microbit.display.set_pixel(2, 2, 0)
+
+if __name__ == '__main__':
+    record()
@@ -0,0 +1,97 @@
+""" Run all effects in one program and switch between them.
+
+    Each script runs its effect in an endless loop, so switching to
+    another effect means flashing another script. The Runner instead
+    drives effects written as generators, e.g. waves_effect() in
+    waves.py: after drawing and showing a frame, an effect yields the
+    time in ms until its next frame is due, and the Runner waits for
+    it with a FrameScheduler. Only the active effect is resumed;
+    pressing both buttons switches to the next one, which continues
+    where it left off, since its generator keeps its state.
+
+    An effect does its setup (allocating its display, compiling its
+    animation) before its first yield, which yields 0. The Runner
+    runs all setups when it's created, so switching effects later
+    doesn't import or allocate anything. When an effect becomes
+    active, it's resumed with .send(True), so that it shows its frame
+    again (e.g. restarts its animation or shows an unchanged frame
+    anyway); otherwise the yield returns False.
+
+    The effects show their frames themselves instead of yielding
+    them together with the delay, since yielding (image, delay)
+    tuples would allocate on every frame.
+
+"""
+import microbit
+from scheduler import FrameScheduler
+
+### Runner class
+
+class Runner:
+
+    # Index of the active effect in .effects
+    current = 0
+
+    # Set if the active effect has to show its frame again
+    resumed = True
+
+    # Set while both buttons are held, so that holding them switches
+    # only once
+    switching = False
+
+    def __init__(self, effects):
+
+        self.effects = effects
+        self.scheduler = FrameScheduler()
+        # Run all setups now
+        for effect in effects:
+            next(effect)
+
+    def switch(self, index=None):
+
+        """ Make effect index the active one; default is the next one.
+
+        """
+        if index is None:
+            index = self.current + 1
+        self.current = index % len(self.effects)
+        self.resumed = True
+        self.scheduler.start()
+
+    def run(self):
+
+        """ Run the active effect, switching effects when both buttons
+            are pressed.
+
+        """
+        scheduler = self.scheduler
+        button_a = microbit.button_a
+        button_b = microbit.button_b
+        scheduler.start()
+        while True:
+            resumed = self.resumed
+            self.resumed = False
+            scheduler.period = self.effects[self.current].send(resumed)
+            scheduler.wait()
+            if button_a.is_pressed() and button_b.is_pressed():
+                if not self.switching:
+                    self.switching = True
+                    self.switch()
+            else:
+                self.switching = False
+
+###
+
+if __name__ == '__main__':
+    from alive import heartbeat_effect
+    from waves import waves_effect
+    from snake import snake_effect
+    from fsnake import snake_effect as fsnake_effect
+    from points import sines_effect
+    from balance import balance_effect
+    Runner([waves_effect(175),
+            snake_effect(100),
+            fsnake_effect(100),
+            sines_effect(300),
+            balance_effect(),
+            heartbeat_effect(100)]).run()
@@ -0,0 +1,114 @@
+""" Frame scheduler keeping effects at a steady frame rate.
+
+    Sleeping for a fixed delay after each frame makes the frame period
+    delay plus the time needed to compute and show the frame, so it
+    changes with the effect and with the load. A FrameScheduler keeps
+    a deadline per frame based on microbit.running_time() instead and
+    only sleeps for the time left until the next frame is due.
+
+    Frames which are done late count as overruns. By default, the
+    schedule then starts over from the late frame; with drop set, it
+    is kept and the frames which are overdue already are skipped, so
+    that an animation keeps its speed at the expense of smoothness.
+
+    The scheduler records the achieved frame rate, the jitter (how
+    late frames start after their deadline) and the overruns, using
+    small ints only, so it doesn't allocate while running.
+
+"""
+import microbit
+
+### Frame scheduler class
+
+class FrameScheduler:
+
+    # Time between frames in ms; 0 runs the frames as fast as
+    # possible
+    period = 0
+
+    # If set, frames which are overdue are dropped instead of
+    # delaying the following ones
+    drop = False
+
+    # Time the current frame was due and the time of .start() in ms
+    due = 0
+    started = 0
+
+    # Number of frames, frames done after the next one was due and
+    # frames dropped since .start()
+    frames = 0
+    overruns = 0
+    dropped = 0
+
+    # Sum and maximum of the time frames started after their
+    # deadline in ms
+    jitter_total = 0
+    jitter_max = 0
+
+    def __init__(self, period=0, drop=False):
+
+        self.period = period
+        self.drop = drop
+        self.start()
+
+    def start(self):
+
+        """ Start a new schedule with the current frame due now and
+            reset the statistics.
+
+        """
+        self.due = self.started = microbit.running_time()
+        self.frames = self.overruns = self.dropped = 0
+        self.jitter_total = self.jitter_max = 0
+
+    def wait(self):
+
+        """ Wait until the next frame is due.
+
+            Returns the number of frames dropped, which is always 0
+            unless .drop is set; the caller should skip them, e.g.
+            by advancing its frame counter.
+
+        """
+        self.frames += 1
+        period = self.period
+        if not period:
+            return 0
+        now = microbit.running_time()
+        due = self.due + period
+        dropped = 0
+        if now > due:
+            self.overruns += 1
+            if self.drop:
+                # Skip to the first frame which can still be shown
+                # in time
+                dropped = (now - due) // period + 1
+                due += dropped * period
+                self.dropped += dropped
+        if now < due:
+            microbit.sleep(due - now)
+            now = microbit.running_time()
+        late = now - due
+        if late > 0:
+            self.jitter_total += late
+            if late > self.jitter_max:
+                self.jitter_max = late
+            if not self.drop:
+                # Don't catch up with a burst of frames
+                due = now
+        self.due = due
+        return dropped
+
+    def stats(self):
+
+        """ Return (frames per second, mean and maximum jitter in ms,
+            overruns, frames dropped) since .start().
+
+        """
+        elapsed = microbit.running_time() - self.started
+        frames = self.frames
+        return (frames * 1000.0 / elapsed if elapsed else 0.0,
+                self.jitter_total / frames if frames else 0.0,
+                self.jitter_max,
+                self.overruns,
+                self.dropped)
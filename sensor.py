@@ -0,0 +1,158 @@
+""" Filtered accelerometer readings at an adaptive rate.
+
+    Reading the accelerometer on every iteration of an effect loop
+    costs two sensor reads per frame and passes the sensor noise
+    straight on to the effect, which then renders a new frame for
+    every jitter. A TiltSensor reads the x and y axes only every
+    period ms, averages batch readings and smooths the averages with
+    an integer low-pass filter, so no floats are needed:
+
+        filtered += (average - filtered) >> shift
+
+    (in fixed point, see SHIFT). The filtered values are only passed
+    on as .x and .y once they move by more than threshold milli-g
+    from the values passed on before, so holding the board still
+    doesn't change anything. Values within threshold of 0 are passed
+    on as 0, so a board lying flat reads as level.
+
+    Once the values haven't moved for still_after ms, the sensor
+    falls back to reading every slow_period ms, which saves CPU time
+    (and power) while the board lies still; the first movement
+    switches back to period. An effect which is still moving things
+    around by the last values (e.g. the drop in balance.py rolling
+    over a tilted board) can keep the fast rate with .wake().
+
+"""
+import microbit
+
+# Fractional bits of the filtered values
+SHIFT = 4
+
+### Tilt sensor class
+
+class TiltSensor:
+
+    # Filtered readings in milli-g as passed on to the effect
+    x = 0
+    y = 0
+
+    # Filtered readings in milli-g, scaled by 1 << SHIFT
+    filtered_x = 0
+    filtered_y = 0
+
+    # Sums and number of the readings of the current batch
+    sum_x = 0
+    sum_y = 0
+    count = 0
+
+    # Current time between readings, time the next reading is due,
+    # time of the last movement and of the last call of .update(),
+    # all in ms
+    interval = 0
+    due = 0
+    moved_at = 0
+    now = 0
+
+    # Number of readings taken and of updates of .x and .y
+    readings = 0
+    updates = 0
+
+    def __init__(self, period=10, batch=2, shift=2, threshold=16,
+                 still_after=1000, slow_period=100):
+
+        self.period = period
+        self.batch = batch
+        self.shift = shift
+        self.threshold = threshold
+        self.still_after = still_after
+        self.slow_period = slow_period
+        self.accelerometer = microbit.accelerometer
+        # Start from the current readings
+        accelerometer = self.accelerometer
+        x = accelerometer.get_x()
+        y = accelerometer.get_y()
+        self.filtered_x = x << SHIFT
+        self.filtered_y = y << SHIFT
+        if -threshold <= x <= threshold:
+            x = 0
+        if -threshold <= y <= threshold:
+            y = 0
+        self.x = x
+        self.y = y
+        self.interval = period
+        self.due = self.moved_at = microbit.running_time()
+
+    def update(self):
+
+        """ Take a reading, if one is due.
+
+            Returns True if .x and .y changed.
+
+        """
+        now = self.now = microbit.running_time()
+        if now < self.due:
+            return False
+        self.due = now + self.interval
+        accelerometer = self.accelerometer
+        self.sum_x += accelerometer.get_x()
+        self.sum_y += accelerometer.get_y()
+        self.readings += 1
+        count = self.count + 1
+        if count < self.batch:
+            self.count = count
+            return False
+        shift = self.shift
+        # Low-pass filter the batch average
+        filtered_x = self.filtered_x
+        filtered_x += (((self.sum_x << SHIFT) // count - filtered_x)
+                       >> shift)
+        self.filtered_x = filtered_x
+        filtered_y = self.filtered_y
+        filtered_y += (((self.sum_y << SHIFT) // count - filtered_y)
+                       >> shift)
+        self.filtered_y = filtered_y
+        self.sum_x = self.sum_y = self.count = 0
+        x = filtered_x >> SHIFT
+        y = filtered_y >> SHIFT
+        threshold = self.threshold
+        # Tilts within the threshold count as level, so that the
+        # values settle at 0 when the board is put down flat, instead
+        # of at whatever was passed on last
+        if -threshold <= x <= threshold:
+            x = 0
+        if -threshold <= y <= threshold:
+            y = 0
+        dx = x - self.x
+        dy = y - self.y
+        if (dx > threshold or dx < -threshold or
+            dy > threshold or dy < -threshold):
+            self.x = x
+            self.y = y
+            self.updates += 1
+            self.wake(now)
+            return True
+        if now - self.moved_at >= self.still_after:
+            self.interval = self.slow_period
+        return False
+
+    def wake(self, now=None):
+
+        """ Read at the fast rate again, starting now.
+
+        """
+        if now is None:
+            now = microbit.running_time()
+        self.moved_at = now
+        if self.interval != self.period:
+            self.interval = self.period
+            if self.due > now + self.period:
+                self.due = now + self.period
+
+    def sleep(self):
+
+        """ Sleep until the next reading is due.
+
+        """
+        delay = self.due - microbit.running_time()
+        if delay > 0:
+            microbit.sleep(delay)
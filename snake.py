@@ -7,7 +7,12 @@
 
 """
 import microbit
-import math
+import brightness
+from animation import Animation
+from oscillator import Oscillator, ONE, SHIFT
+from scheduler import FrameScheduler
+from buttons import Buttons
+from stages import COMPUTE, BLIT, SLEEP
 
 ### Smart disply class
 
@@ -16,30 +21,141 @@ class SmartDisplay:
     # Array of LED brightness levels (0=off, 8=on); rows and columns
     # correspond to the LEDs on the Microbit, e.g. leds[0][2] maps
     # to the second LED in the first row.
+    #
+    # This is the back buffer all drawing goes to.
     leds = None
 
+    # Front buffer: MB image which .display() fills in place and
+    # hands to the MB display. The display copies the image, so it
+    # can be reused for the next frame right away.
+    image = None
+
+    # Column origin: the rows are used as ring buffers, with
+    # column 0 stored at index origin. Scrolling only moves the
+    # origin instead of rebuilding the rows.
+    origin = 0
+
+    # Row indexes of the columns per origin, i.e.
+    # rotations[origin][column] == (origin + column) % 5
+    rotations = tuple(tuple((origin + column) % 5 for column in range(5))
+                      for origin in range(5))
+
+    # Work lists for add_point()
+    row_levels = None
+    column_terms = None
+
+    # Table mapping the brightness levels to MB LED levels; use
+    # brightness.level_table(gamma) for a gamma curve
+    levels = brightness.level_table()
+
+    # Copy of the rows, the origin and the table last written to
+    # .image; only the rows which changed since are written again.
+    # While the display scrolls, the rows aren't copied and stale
+    # is set.
+    shown = None
+    shown_origin = None
+    shown_levels = None
+    stale = True
+
+    # Set when .image differs from what .display() last showed
+    changed = True
+
+    # Number of frames shown and skipped by .display()
+    blits = 0
+    skips = 0
+
     def __init__(self):
 
-        self.clear()
+        self.leds = [bytearray(5) for i in range(5)]
+        self.shown = [bytearray(5) for i in range(5)]
+        self.image = microbit.Image(5, 5)
+        self.row_levels = [0.0] * 5
+        self.column_terms = [0.0] * 5
     
     def clear(self):
         
         """ Clear the SmartDisplay.
+
+            The rows are cleared in place, so no memory gets
+            allocated.
         
         """
-        self.leds = [bytearray(5) for i in range(5)]
+        for row in self.leds:
+            for column in range(5):
+                row[column] = 0
+        self.origin = 0
+
+    def render(self):
+
+        """ Write the contents of the SmartDisplay to the
+            MB image buffer and return it.
+
+            The front buffer image is reused, so no memory gets
+            allocated for it. Rows which didn't change since the
+            last call are not written again.
+
+        """
+        leds = self.leds
+        shown = self.shown
+        image = self.image
+        origin = self.origin
+        columns = self.rotations[origin]
+        levels = self.levels
+        redraw = copy = True
+        if origin != self.shown_origin or levels is not self.shown_levels:
+            # Scrolling or a new table changes all pixels; the rows
+            # are only compared again once the display stays put
+            self.shown_origin = origin
+            self.shown_levels = levels
+            self.stale = True
+            copy = False
+        elif self.stale:
+            self.stale = False
+        else:
+            redraw = False
+        changed = redraw
+        for row in range(5):
+            leds_row = leds[row]
+            if not redraw:
+                if leds_row == shown[row]:
+                    continue
+                changed = True
+            if copy:
+                shown[row][:] = leds_row
+            for column in range(5):
+                image.set_pixel(column, row, levels[leds_row[columns[column]]])
+        if changed:
+            self.changed = True
+        return image
+
+    def display(self, force=False):
 
-    def display(self):
-        
         """ Write the contents of the SmartDisplay to the
             MB image buffer and display it.
-            
+
+            The frame is only shown if it changed since the last
+            call, see .blit().
+
         """
-        img_array = bytearray()
-        for row in self.leds:
-            img_array.extend(row)
-        img = microbit.Image(5, 5, img_array)
-        microbit.display.show(img)
+        self.render()
+        self.blit(force)
+
+    def blit(self, force=False):
+
+        """ Hand the image written by the last .render() to the MB
+            display, unless it's shown already.
+
+            .blits and .skips count the frames shown and skipped.
+            Pass force=True if something else was shown on the MB
+            display in the meantime.
+
+        """
+        if self.changed or force:
+            microbit.display.show(self.image)
+            self.changed = False
+            self.blits += 1
+        else:
+            self.skips += 1
 
     def set_dot(self, row, column, level=9):
 
@@ -48,7 +164,7 @@ class SmartDisplay:
             Does not clear the other content.
 
         """
-        self.leds[row][column] = level
+        self.leds[row][self.rotations[self.origin][column]] = level
 
     def show_point(self, row, column, level=9, scale=5.0):
       
@@ -58,15 +174,53 @@ class SmartDisplay:
             All other display content is cleared.
             
         """
+        self.clear()
+        self.add_point(row, column, level, scale)
+
+    def add_point(self, row, column, level=9, scale=5.0):
+
+        """ Add a point at floating point row and column to the
+            display content, interpolating the brightness.
+
+            Only the LEDs the point reaches are visited, so the
+            cost depends on the size of the point, not the display.
+
+        """
+        # The squared distance splits into a row and a column term,
+        # which are computed once per row and column. The LEDs with
+        # level - scale * d2 > 0 then lie within the ranges of rows
+        # and columns where the terms alone stay below level.
+        row_levels = self.row_levels
+        column_terms = self.column_terms
+        first_row = first_column = 5
+        last_row = last_column = 0
+        for i in range(5):
+            d = row - i
+            x = level - scale * d * d
+            row_levels[i] = x
+            if x > 0.0:
+                if i < first_row:
+                    first_row = i
+                last_row = i + 1
+            d = column - i
+            x = scale * d * d
+            column_terms[i] = x
+            if x < level:
+                if i < first_column:
+                    first_column = i
+                last_column = i + 1
         leds = self.leds
-        for led_row in range(5):
-            for led_column in range(5):
-                # Calculate the squared distance
-                d2 = (row - led_row)**2.0 + (column - led_column)**2.0
-                # Set brightness based on the distance to the point,
-                # using scale for scaling
-                leds[led_row][led_column] = int(
-                    max(level - scale * d2, 0))
+        columns = self.rotations[self.origin]
+        for led_row in range(first_row, last_row):
+            leds_row = leds[led_row]
+            row_level = row_levels[led_row]
+            for led_column in range(first_column, last_column):
+                x = row_level - column_terms[led_column]
+                if x > 0.0:
+                    # Make sure we don't overflow
+                    our_column = columns[led_column]
+                    leds_row[our_column] = min(
+                        leds_row[our_column] + int(x), 9)
 
     def add(self, sd, offset_row=0, offset_column=0):
         
@@ -74,71 +228,139 @@ class SmartDisplay:
         
         """
         leds = self.leds
-        for row in range(5):
-            # Make sure we keep within the display bounds
-            if offset_row:
-                other_row_index = row + offset_row
-                if (other_row_index > 4 or 
-                    other_row_index < 0):
-                    continue
-            else:
-                other_row_index = row
+        our_columns = self.rotations[self.origin]
+        other_columns = self.rotations[sd.origin]
+        saturate = brightness.SATURATE
+        # Clip the overlapping area once, instead of per LED
+        first_row = max(0, -offset_row)
+        last_row = min(5, 5 - offset_row)
+        first_column = max(0, -offset_column)
+        last_column = min(5, 5 - offset_column)
+        for row in range(first_row, last_row):
             our_row = leds[row]
-            other_row = sd.leds[other_row_index]
-            for column in range(5):
-                # Make sure we keep within the display bounds
-                if offset_column:
-                    other_column = column + offset_column
-                    if (other_column > 4 or 
-                        other_column < 0):
-                        continue
-                else:
-                    other_column = column
+            other_row = sd.leds[row + offset_row]
+            for column in range(first_column, last_column):
                 # Make sure we don't overflow
-                our_row[column] = min(
-                    our_row[column] + other_row[other_column], 9)
+                our_column = our_columns[column]
+                our_row[our_column] = saturate[
+                    our_row[our_column] +
+                    other_row[other_columns[column + offset_column]]]
 
     def dim(self, factor=0.5):
         
         """ Dim the SmartDisplay content by factor.
+
+            The dimmed levels come from a table cached per factor,
+            so no float math is needed per LED.
         
         """
-        leds = self.leds
-        for row in range(5):
-            row = leds[row]
+        self.map_levels(brightness.dim_table(factor))
+
+    def fade(self, amount=1):
+
+        """ Reduce the levels of the SmartDisplay content by amount,
+            but not below 0.
+
+        """
+        self.map_levels(brightness.fade_table(amount))
+
+    def map_levels(self, table):
+
+        """ Replace each level of the SmartDisplay content by
+            table[level].
+
+        """
+        for row in self.leds:
             for column in range(5):
-                row[column] = round(row[column] * factor)
+                row[column] = table[row[column]]
 
     def scroll_left(self, columns=1):
     
         """ Scroll the display to the left by the given number
             of columns (default is one).
+
+            Only the origin is moved and the columns scrolled in
+            are cleared, so no memory gets allocated.
         
         """
-        leds = self.leds
-        columns = min(columns, 5)
-        filler = bytearray(columns)
-        for row in range(5):
-            leds[row] = leds[row][columns:] + filler
+        origin = self.origin
+        if columns > 5:
+            columns = 5
+        for row in self.leds:
+            # The columns scrolled out become the right-most ones
+            for i in range(columns):
+                row[(origin + i) % 5] = 0
+        self.origin = (origin + columns) % 5
 
 ###
 
-def snake(delay, segments=9):
-    
+def compile_snake(segments):
+
+    """ Return the (intro, cycle) images of the snake.
+
+    """
     sd = SmartDisplay()
+    # The dot moves up and down once per segments frames
+    wave = Oscillator(segments)
+
+    def render(i, segments):
+        if i == 0:
+            sd.clear()
+        sd.scroll_left()
+        sd.dim(0.8)
+        y = wave.sample(i)
+        # round(2 + 2 * y) with y scaled by ONE
+        row = (2 * ONE + 2 * y + ONE // 2) >> SHIFT
+        sd.set_dot(row, 4)
+        return sd.render()
+
+    # Once the tail has built up, the snake repeats every segments
+    # frames; the animation finds the cycle and renders it once
+    return Animation(render).compile(segments)
+
+def snake(delay, segments=9, profiler=None):
+    
+    intro, cycle = compile_snake(segments)
+    # Show a frame every delay ms, no matter how long it takes to
+    # show it
+    scheduler = FrameScheduler(delay)
+    buttons = Buttons()
+    for img in intro:
+        microbit.display.show(img)
+        scheduler.wait()
+    if profiler:
+        profiler.start(buttons)
     while True:
-        for i in range(segments):
-            sd.scroll_left()
-            sd.dim(0.8)
-            x = i * 2*math.pi / segments
-            y = math.sin(x)
-            row = round(2 + 2 * y)
-            sd.set_dot(row, 4)
-            sd.display()
-            microbit.sleep(delay)
-        if microbit.button_a.is_pressed():
-            delay = max(0, delay - 10)
-        if microbit.button_b.is_pressed():
-            delay += 10
-
-snake(100)
+        for img in cycle:
+            microbit.display.show(img)
+            if profiler:
+                profiler.mark(BLIT)
+            scheduler.wait()
+            if profiler:
+                profiler.mark(SLEEP)
+            if buttons.poll():
+                scheduler.period = buttons.adjust(scheduler.period, 10)
+            if profiler:
+                profiler.mark(COMPUTE)
+                profiler.next()
+
+def snake_effect(delay, segments=9):
+
+    """ Generator version of snake() for the Runner (see runner.py).
+
+    """
+    intro, cycle = compile_snake(segments)
+    buttons = Buttons()
+    yield 0
+    for img in intro:
+        microbit.display.show(img)
+        yield delay
+    while True:
+        for img in cycle:
+            microbit.display.show(img)
+            yield delay
+            if buttons.poll():
+                delay = buttons.adjust(delay, 10)
+
+if __name__ == '__main__':
+    snake(100)
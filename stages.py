@@ -0,0 +1,13 @@
+""" Stages of a frame, as recorded by a Profiler (see profiler.py).
+
+    Kept apart from the profiler, so that the effects can mark their
+    stages without loading the profiler and its array and gc imports
+    onto the device when they run without one.
+
+"""
+COMPUTE = 0     # drawing the frame, reading sensors and buttons
+QUANTIZE = 1    # mapping brightness levels to MB LED levels
+BLIT = 2        # handing the frame to the MB display
+SLEEP = 3       # waiting for the next frame
+
+STAGES = ('compute', 'quantize', 'blit', 'sleep')
@@ -7,36 +7,69 @@
 
 """
 import microbit
-import math
+from animation import Animation
+from oscillator import Oscillator
+from scheduler import FrameScheduler
+from buttons import Buttons
+from stages import COMPUTE, BLIT, SLEEP
 
 # Array of LED brightness levels (0=off, 8=on); rows and columns
 # correspond to the LEDs on the Microbit, e.g. leds[0][2] maps
 # to the second LED in the first row.
 leds = tuple(bytearray(5) for i in range(5))
 
-def display_leds():
-    
-    img_array = bytearray()
-    for row in leds:
-        img_array.extend(row)
-    img = microbit.Image(5, 5, img_array)
-    microbit.display.show(img)
+# The wave repeats every 8 rows or offsets
+wave = Oscillator(8, amplitude=4)
+
+def render_waves(offset):
 
-def waves(delay):
+    for row in range(5):
+        level = wave.sample(row + offset) + 4
+        for column in range(5):
+            leds[row][column] = level
+    return leds
+
+def waves(delay, profiler=None):
     
-    offset = 0
+    # The waves repeat every 8 offsets, so only render those once
+    intro, cycle = Animation(render_waves, period=8).compile()
+    # Show a frame every delay ms; frames which are overdue are
+    # skipped, so that the waves keep their speed
+    scheduler = FrameScheduler(delay, drop=True)
+    buttons = Buttons()
+    frames = len(cycle)
+    i = 0
+    if profiler:
+        profiler.start(buttons)
+    while True:
+        microbit.display.show(cycle[i])
+        if profiler:
+            profiler.mark(BLIT)
+        i = (i + 1 + scheduler.wait()) % frames
+        if profiler:
+            profiler.mark(SLEEP)
+        if buttons.poll():
+            scheduler.period = buttons.adjust(scheduler.period, 10)
+        if profiler:
+            profiler.mark(COMPUTE)
+            profiler.next()
+
+def waves_effect(delay):
+
+    """ Generator version of waves() for the Runner (see runner.py).
+
+    """
+    intro, cycle = Animation(render_waves, period=8).compile()
+    buttons = Buttons()
+    frames = len(cycle)
+    i = 0
+    yield 0
     while True:
-        for row in range(5):
-            x = (row + offset) % 8 / 4 * math.pi
-            level = int(math.sin(x) * 4 + 4)
-            for column in range(5):
-                leds[row][column] = level
-        display_leds()
-        microbit.sleep(delay)
-        offset += 1
-        if microbit.button_a.is_pressed():
-            delay = max(0, delay - 10)
-        if microbit.button_b.is_pressed():
-            delay += 10
-
-waves(175)
+        microbit.display.show(cycle[i])
+        i = (i + 1) % frames
+        if buttons.poll():
+            delay = buttons.adjust(delay, 10)
+        yield delay
+
+if __name__ == '__main__':
+    waves(175)